@@ -0,0 +1,117 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Issues getPower for many lights at once, like a dashboard opening, against a fake bridge that serves one
+# request at a time, with and without batching single light reads.
+#
+#   python -m benchmarks.batch_reader [lights] [latency ms] [window ms]
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hue_bridge import service, backend
+from hue_bridge.breaker import CircuitBreaker
+import threading
+import time
+import json
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.__body = body
+
+    def json(self):
+        return json.loads(self.__body)
+
+
+class FakeRequests:
+    # like the bridge, handles one request at a time
+    def __init__(self, lights, latency):
+        self.__lights = {str(num): {"state": {"on": bool(num % 2), "bri": 254, "reachable": True}, "type": "Dimmable light"} for num in range(1, lights + 1)}
+        self.__latency = latency
+        self.__lock = threading.Lock()
+        self.requests = 0
+
+    def get(self, url, verify, timeout):
+        with self.__lock:
+            self.requests += 1
+            time.sleep(self.__latency)
+            resource = url.rsplit("/", 2)
+            if resource[-1] == "lights":
+                return FakeResponse(json.dumps(self.__lights))
+            return FakeResponse(json.dumps(self.__lights[resource[-1]]))
+
+
+class FakeHueBridge:
+    def __init__(self, id, read_batch_window):
+        self.id = id
+        self.host = "127.0.0.1"
+        self.api_key = "benchmark"
+        self.request_timeout = 5
+        self.read_batch_window = read_batch_window
+        self.api_version = "v1"
+        self.breaker = CircuitBreaker(name=id, threshold=3, reset_timeout=30)
+
+    def success(self):
+        self.breaker.success()
+
+    def failure(self, reachable=True):
+        self.breaker.failure()
+
+
+class FakeDevice:
+    def __init__(self, number, bridge):
+        self.id = "light-{}".format(number)
+        self.number = str(number)
+        self.bridge = bridge
+        self.data = {"state": {"on": False}}
+
+    def mask_transition(self, state):
+        return state
+
+
+def measure(lights, latency, window):
+    fake = FakeRequests(lights, latency)
+    backend.requests = fake
+    bridge = FakeHueBridge("bridge-{}".format(window), window)
+    devices = [FakeDevice(num, bridge) for num in range(1, lights + 1)]
+    results = dict()
+    threads = [threading.Thread(target=lambda device: results.update({device.id: service.get_light_power(device)}), args=(device, )) for device in devices]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    assert all(results[device.id]["power"] == bool(int(device.number) % 2) for device in devices)
+    return duration, fake.requests
+
+
+def main():
+    lights = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    window = (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+    print("{:<12}{:>12}{:>12}".format("reads", "seconds", "requests"))
+    print("{:<12}{:>12.3f}{:>12}".format("single", *measure(lights, latency, 0)))
+    print("{:<12}{:>12.3f}{:>12}".format("batched", *measure(lights, latency, window)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Compares the memory footprint of the dict based device representation with the slotted one.
+#
+#   python -m benchmarks.device_memory [number of devices]
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hue_bridge.device import DeviceData, MetaData
+import tracemalloc
+import gc
+
+
+def gen_poll(number: int, cycle: int) -> dict:
+    return {
+        "meta_data": {
+            "name": "Hue color lamp {}".format(number),
+            "model_id": "LCT015",
+            "type": "Extended color light",
+            "manufacturer_name": "Signify Netherlands B.V.",
+            "sw_version": "1.88.1",
+            "number": str(number)
+        },
+        "data": {
+            "state": {
+                "on": bool(cycle % 2),
+                "bri": 254,
+                "hue": 8418,
+                "sat": 140,
+                "effect": "none",
+                "xy": [0.4573, 0.41],
+                "ct": 366,
+                "alert": "select",
+                "colormode": "ct",
+                "mode": "homeautomation",
+                "reachable": True
+            },
+            "config": {}
+        }
+    }
+
+
+def legacy(poll: dict):
+    meta_data = dict(poll["meta_data"])
+    return (
+        meta_data,
+        {"state": dict(poll["data"]["state"]), "config": dict(poll["data"]["config"])},
+        [
+            {"key": "manufacturer", "value": meta_data["manufacturer_name"]},
+            {"key": "model", "value": meta_data["model_id"]},
+            {"key": "firmware", "value": meta_data["sw_version"]}
+        ]
+    )
+
+
+def slotted(poll: dict):
+    return MetaData(poll["meta_data"]), DeviceData(poll["data"])
+
+
+def measure(func, *args):
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    result = func(*args)
+    end, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, end - start, peak - start
+
+
+def main(count: int):
+    polls = [gen_poll(number, 0) for number in range(count)]
+    next_polls = [gen_poll(number, 1) for number in range(count)]
+
+    legacy_devices, legacy_size, _ = measure(lambda: [legacy(poll) for poll in polls])
+    slotted_devices, slotted_size, _ = measure(lambda: [slotted(poll) for poll in polls])
+    print("resident size for {} devices:".format(count))
+    print("  dict:    {:>10} bytes ({:.0f} per device)".format(legacy_size, legacy_size / count))
+    print("  slotted: {:>10} bytes ({:.0f} per device)".format(slotted_size, slotted_size / count))
+
+    def legacy_cycle():
+        for i, poll in enumerate(next_polls):
+            legacy_devices[i] = legacy(poll)
+
+    def slotted_cycle():
+        for (meta_data, data), poll in zip(slotted_devices, next_polls):
+            meta_data.update(poll["meta_data"])
+            data.update(poll["data"])
+
+    _, _, legacy_churn = measure(legacy_cycle)
+    _, _, slotted_churn = measure(slotted_cycle)
+    print("bytes allocated per poll cycle:")
+    print("  dict:    {:>10} bytes".format(legacy_churn))
+    print("  slotted: {:>10} bytes".format(slotted_churn))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,65 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Measures the cost of hot path log calls at the production log level.
+#
+#   python -m benchmarks.logging_overhead [iterations]
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.logger import init_logger, get_logger, handler, RateLimitFilter
+import logging
+import timeit
+import json
+import io
+
+
+logger = get_logger("benchmark")
+
+payload = json.dumps({"command_id": "1a2b3c", "data": json.dumps({"red": 255, "green": 120, "blue": 0, "duration": 1.5})})
+
+
+def eager():
+    logger.debug("{}: '{}' <- '{}'".format("worker-00:17:88:01:00:00:01:0b-0b", "setColor", payload))
+
+
+def lazy():
+    logger.debug("%s: '%s' <- '%s'", "worker-00:17:88:01:00:00:01:0b-0b", "setColor", payload)
+
+
+def repeated_error():
+    logger.error("could not query bridge - '%s'", "connection timed out")
+
+
+def main(iterations: int):
+    handler.setStream(io.StringIO())
+    init_logger("warning")
+    print("{:<32}{:>12}".format("call", "ns per call"))
+    for name, func in (("debug eager (.format)", eager), ("debug lazy (%s args)", lazy)):
+        print("{:<32}{:>12.0f}".format(name, timeit.timeit(func, number=iterations) / iterations * 1e9))
+    print("{:<32}{:>12.0f}".format("error unlimited", timeit.timeit(repeated_error, number=iterations) / iterations * 1e9))
+    handler.addFilter(RateLimitFilter(60))
+    print("{:<32}{:>12.0f}".format("error rate limited", timeit.timeit(repeated_error, number=iterations) / iterations * 1e9))
+    handler.filters.clear()
+    logging.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
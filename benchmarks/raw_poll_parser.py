@@ -0,0 +1,123 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Compares allocations per poll cycle of the full json parse with the raw poll parser.
+#
+#   python -m benchmarks.raw_poll_parser [number of devices] [changed devices per cycle]
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hue_bridge.parser import RawPollParser, parse_device
+import tracemalloc
+import functools
+import json
+import time
+
+
+type_map = {"Extended color light": "dt-1"}
+
+
+def gen_response(count: int, cycle: int, changes: int) -> bytes:
+    lights = dict()
+    for number in range(1, count + 1):
+        lights[str(number)] = {
+            "state": {
+                "on": True,
+                "bri": (cycle if number <= changes else 0) % 254 + 1,
+                "hue": 8418,
+                "sat": 140,
+                "effect": "none",
+                "xy": [0.4573, 0.41],
+                "ct": 366,
+                "alert": "select",
+                "colormode": "ct",
+                "mode": "homeautomation",
+                "reachable": True
+            },
+            "swupdate": {"state": "noupdates", "lastinstall": "2020-12-01T10:21:14"},
+            "type": "Extended color light",
+            "name": "Hue color lamp {}".format(number),
+            "modelid": "LCT015",
+            "manufacturername": "Signify Netherlands B.V.",
+            "productname": "Hue color lamp",
+            "capabilities": {"certified": True, "control": {"mindimlevel": 1000, "maxlumen": 806, "colorgamuttype": "C", "colorgamut": [[0.6915, 0.3083], [0.17, 0.7], [0.1532, 0.0475]], "ct": {"min": 153, "max": 500}}, "streaming": {"renderer": True, "proxy": True}},
+            "config": {"archetype": "sultanbulb", "function": "mixed", "direction": "omnidirectional", "startup": {"mode": "safety", "configured": True}},
+            "uniqueid": "00:17:88:01:00:{:02x}:{:02x}:0b-0b".format(number // 256, number % 256),
+            "swversion": "1.88.1",
+            "swconfigid": "E4C8F3E4"
+        }
+    return json.dumps(lights).encode()
+
+
+def full_cycle(raw: bytes):
+    devices = dict()
+    for number, device in json.loads(raw).items():
+        item = parse_device(number, device, type_map, "")
+        if item:
+            devices[item[0]] = item[1]
+    return devices
+
+
+def raw_cycle(parser: RawPollParser, raw: bytes):
+    devices = dict()
+    changed = set()
+    for item, item_changed in parser.parse("lights", raw):
+        if item:
+            devices[item[0]] = item[1]
+            if item_changed:
+                changed.add(item[0])
+    return devices, changed
+
+
+def measure(func, responses):
+    tracemalloc.start()
+    peaks = list()
+    for raw in responses:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func(raw)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+    tracemalloc.stop()
+    return sum(peaks) / len(peaks)
+
+
+def timeit(func, responses):
+    start_time = time.perf_counter()
+    for raw in responses:
+        func(raw)
+    return (time.perf_counter() - start_time) / len(responses)
+
+
+def main(count: int, changes: int, cycles: int = 20):
+    responses = [gen_response(count, cycle, changes) for cycle in range(cycles)]
+    parser = RawPollParser(functools.partial(parse_device, type_map=type_map, device_id_prefix=""))
+    raw_cycle(parser, responses[-1])
+    print("{} devices, {} changed per cycle, {} bytes per response".format(count, changes, len(responses[0])))
+    print("{:<12}{:>24}{:>16}".format("mode", "allocated bytes (peak)", "ms per cycle"))
+    for name, func in (("full", full_cycle), ("raw", functools.partial(raw_cycle, parser))):
+        print("{:<12}{:>24.0f}{:>16.3f}".format(name, measure(func, responses), timeit(func, responses) * 1000))
+
+
+if __name__ == '__main__':
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 250,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    )
@@ -0,0 +1,251 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Replays a file written by util.Recorder (RECORDER_ENABLED) through Monitor, Router and Controller with the
+# bridge and broker stubbed, and reports CPU time, published messages and latency distributions. Speed 1 replays
+# in real time, 0 as fast as possible. Pass a results file to append the report as a JSON line.
+#
+#   python -m benchmarks.replay <record file> [speed] [results file] [--raw-parser]
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import Router, record_kind
+from hue_bridge import Monitor, Controller, monitor, backend
+from hue_bridge.breaker import CircuitBreaker
+import collections
+import threading
+import logging
+import json
+import time
+
+
+type_map = {
+    "Extended color light": "dt-extended-color-light",
+    "Color light": "dt-color-light",
+    "Color temperature light": "dt-color-temperature-light",
+    "Dimmable light": "dt-dimmable-light",
+    "On/Off plug-in unit": "dt-on-off-plug-in-unit",
+    "ZLLSwitch": "dt-zll-switch",
+    "ZLLPresence": "dt-zll-presence"
+}
+
+
+class FakeResponse:
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeRequests:
+    # answers GETs from the last recorded poll responses and acknowledges every PUT
+    def __init__(self):
+        self.bodies = {"lights": b"{}", "sensors": b"{}"}
+        self.requests = 0
+        self.__parsed = dict()
+
+    @staticmethod
+    def __resource(url: str) -> list:
+        return url.split("/api/", 1)[1].split("/")[1:]
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        path = self.__resource(url)
+        body = self.bodies.get(path[0], b"{}")
+        if len(path) == 1:
+            return FakeResponse(body)
+        if self.__parsed.get(path[0], (None, ))[0] is not body:
+            self.__parsed[path[0]] = (body, json.loads(body))
+        item = self.__parsed[path[0]][1].get(path[1])
+        if item is None:
+            return FakeResponse(json.dumps([{"error": {"description": "resource not available"}}]).encode())
+        return FakeResponse(json.dumps(item).encode())
+
+    def put(self, url, **kwargs):
+        self.requests += 1
+        path = "/" + "/".join(self.__resource(url))
+        return FakeResponse(json.dumps([{"success": {"{}/{}".format(path, key): value}} for key, value in kwargs["json"].items()]).encode())
+
+
+class FakeHueBridge:
+    id = "REPLAY"
+    host = "127.0.0.1"
+    api_key = "replay"
+    request_timeout = 5
+    read_batch_window = 0
+    api_version = "v1"
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(name="replay", threshold=3, reset_timeout=30)
+
+    def success(self):
+        self.breaker.success()
+
+    def failure(self, reachable=True):
+        self.breaker.failure()
+
+
+class FakeMQTTClient:
+    def __init__(self):
+        self.published = collections.Counter()
+        self.sent = dict()
+        self.latencies = list()
+        self.__lock = threading.Lock()
+
+    def command(self, payload: str):
+        try:
+            self.sent[json.loads(payload)["command_id"]] = time.perf_counter()
+        except Exception:
+            pass
+
+    def publish(self, topic, payload, msg_cls):
+        self.published[msg_cls] += 1
+        if msg_cls == "response":
+            sent = self.sent.pop(json.loads(payload)["command_id"], None)
+            if sent is not None:
+                with self.__lock:
+                    self.latencies.append(time.perf_counter() - sent)
+
+    def subscribe(self, topic, qos):
+        pass
+
+    def unsubscribe(self, topic):
+        pass
+
+    def add_subscription(self, topic, qos):
+        pass
+
+    def connected(self):
+        return True
+
+
+def distribution(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(int(q * len(values)), len(values) - 1)]
+    return {"count": len(values), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": values[-1]}
+
+
+def load(path: str) -> list:
+    with open(path) as file:
+        return sorted((json.loads(line) for line in file if line.strip()), key=lambda record: record["t"])
+
+
+def replay(records: list, speed: float, raw_parser: bool) -> dict:
+    fake_requests = FakeRequests()
+    monitor.requests = fake_requests
+    backend.requests = fake_requests
+    mqtt_client = FakeMQTTClient()
+    device_pool = dict()
+    bridge_monitor = Monitor(
+        hue_bridge=FakeHueBridge(),
+        mqtt_client=mqtt_client,
+        device_pool=device_pool,
+        type_map=type_map,
+        query_delay=0,
+        request_timeout=5,
+        device_id_prefix="",
+        dc_id="replay",
+        raw_parser=raw_parser,
+        refresh_jitter=0
+    )
+    controller = Controller(device_pool=device_pool, mqtt_client=mqtt_client)
+    router = Router(bridge_monitor.schedule_refresh, controller.put_command)
+    poll_latencies = list()
+    pending = list()
+
+    def poll():
+        flag = bridge_monitor._Monitor__refresh_flag
+        if flag:
+            bridge_monitor._Monitor__refresh_devices(flag)
+        start = time.perf_counter()
+        devices, changed, complete = bridge_monitor._Monitor__queryBridge(tuple(pending))
+        if devices:
+            bridge_monitor._Monitor__evaluate(devices, changed, complete)
+        bridge_monitor._Monitor__confirm_devices()
+        bridge_monitor._Monitor__events.flush()
+        poll_latencies.append(time.perf_counter() - start)
+        pending.clear()
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    t0 = records[0]["t"] if records else 0
+    for record in records:
+        if speed > 0:
+            delay = wall_start + (record["t"] - t0) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if record["kind"] == record_kind.poll:
+            if record["api"] in pending:
+                poll()
+            if not record.get("same"):
+                fake_requests.bodies[record["api"]] = record["body"].encode()
+            pending.append(record["api"])
+        elif record["kind"] == record_kind.message:
+            if pending:
+                poll()
+            mqtt_client.command(record["payload"])
+            router.route(record["topic"], record["payload"].encode())
+    if pending:
+        poll()
+    # commands for unknown devices are never answered, stop once the workers are idle
+    answered = -1
+    while mqtt_client.sent and answered != len(mqtt_client.latencies):
+        answered = len(mqtt_client.latencies)
+        time.sleep(0.5)
+        while controller.stats["depth"]:
+            time.sleep(0.01)
+    return {
+        "records": len(records),
+        "polls": len(poll_latencies),
+        "commands": sum(1 for record in records if record["kind"] == record_kind.message),
+        "devices": len(device_pool),
+        "bridge_requests": fake_requests.requests,
+        "wall_time": time.perf_counter() - wall_start,
+        "cpu_time": time.process_time() - cpu_start,
+        "published": dict(mqtt_client.published),
+        "unanswered": len(mqtt_client.sent),
+        "poll_latency": distribution(poll_latencies),
+        "command_latency": distribution(mqtt_client.latencies),
+        "controller": controller.stats,
+        "events": bridge_monitor.event_stats
+    }
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if not args:
+        exit("usage: python -m benchmarks.replay <record file> [speed] [results file] [--raw-parser]")
+    speed = float(args[1]) if len(args) > 1 else 0
+    logging.disable(logging.WARNING)
+    report = replay(load(args[0]), speed, "--raw-parser" in sys.argv)
+    report.update({"file": args[0], "speed": speed, "raw_parser": "--raw-parser" in sys.argv, "time": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    print(json.dumps(report, indent=4))
+    if len(args) > 2:
+        with open(args[2], "a") as file:
+            file.write(json.dumps(report) + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Measures inbound messages per second handed off by the paho network thread and routed to the command callback.
+#
+#   python -m benchmarks.router_throughput [messages] [devices]
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import MQTTClient, Router
+from hue_bridge import Controller
+import paho.mqtt.client
+import mgw_dc
+import logging
+import time
+import json
+
+
+class LegacyRouter:
+    # routing as done before topics were precompiled
+    def __init__(self, refresh_callback, command_callback):
+        self.__refresh_callback = refresh_callback
+        self.__command_callback = command_callback
+
+    def route(self, topic, payload):
+        if topic == mgw_dc.dm.gen_refresh_topic():
+            self.__refresh_callback()
+        else:
+            dev_id, srv_id = mgw_dc.com.parse_command_topic(topic)
+            self.__command_callback((dev_id, srv_id, payload))
+
+
+class FakeDevice:
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeMQTTClient:
+    def publish(self, topic, payload, msg_cls):
+        pass
+
+
+def gen_messages(count, devices):
+    payload = json.dumps({"command_id": "1a2b3c", "data": ""}).encode()
+    messages = list()
+    for num in range(count):
+        msg = paho.mqtt.client.MQTTMessage(topic=mgw_dc.com.gen_command_topic("device-{}".format(num % devices), "getPower").encode())
+        msg.payload = payload
+        messages.append(msg)
+    return messages
+
+
+def measure(router, messages):
+    start = time.perf_counter()
+    for msg in messages:
+        router.route(msg.topic, msg.payload)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def measure_handoff(messages):
+    # time spent on the paho network thread, dispatchers are not started
+    mqtt_client = MQTTClient(host="localhost", port=1883, client_id="benchmark", clean_session=True, keep_alive=30)
+    client = mqtt_client._MQTTClient__client
+    start = time.perf_counter()
+    for msg in messages:
+        client._handle_on_message(msg)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    messages = gen_messages(count, devices)
+    # workers answer every command with an error, keep that out of the output
+    logging.disable(logging.ERROR)
+    noop = lambda cmd: None
+    print("{:<28}{:>14}".format("route", "msg/s"))
+    print("{:<28}{:>14.0f}".format("paho handoff", measure_handoff(messages)))
+    print("{:<28}{:>14.0f}".format("legacy, no-op", measure(LegacyRouter(noop, noop), messages)))
+    print("{:<28}{:>14.0f}".format("precompiled, no-op", measure(Router(noop, noop), messages)))
+    device_pool = {"device-{}".format(num): FakeDevice("device-{}".format(num)) for num in range(devices)}
+    controller = Controller(device_pool=device_pool, mqtt_client=FakeMQTTClient(), worker_queue_size=count)
+    print("{:<28}{:>14.0f}".format("precompiled, controller", measure(Router(noop, controller.put_command), messages)))
+    print(controller.stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Polls simulated bridges as fast as possible (JSON parsing, device diffing and event publishing) in supervisor
+# mode and counts the events reaching the MQTT front-end, for different numbers of shard processes.
+#
+#   python -m benchmarks.shard_scaling [bridges] [lights per bridge] [seconds]
+
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import ProxyMQTTClient, MQTTFrontend, Supervisor
+from hue_bridge.parser import parse_device
+from hue_bridge.device import Device
+import multiprocessing
+import threading
+import logging
+import random
+import json
+import time
+
+
+type_map = {"Extended color light": "dt-extended-color-light"}
+
+
+def gen_lights(lights: int) -> dict:
+    return {
+        str(num): {
+            "state": {"on": True, "bri": 254, "ct": 366, "xy": [0.4573, 0.41], "reachable": True, "alert": "select", "colormode": "xy", "mode": "homeautomation"},
+            "type": "Extended color light",
+            "name": "Light {}".format(num),
+            "modelid": "LCT015",
+            "manufacturername": "Signify Netherlands B.V.",
+            "swversion": "1.50.2_r30933",
+            "uniqueid": "00:17:88:01:00:00:{:02x}:{:02x}-0b".format(num // 256, num % 256)
+        } for num in range(1, lights + 1)
+    }
+
+
+def poll_loop(mqtt_client: ProxyMQTTClient, lights: int):
+    raw = gen_lights(lights)
+    device_pool = dict()
+    while True:
+        for light in random.sample(list(raw.values()), max(lights // 10, 1)):
+            light["state"]["bri"] = random.randint(1, 254)
+        queried = dict(parse_device(number, device, type_map, "") for number, device in json.loads(json.dumps(raw)).items())
+        for device_id, data in queried.items():
+            device = device_pool.get(device_id)
+            if device is None:
+                device_pool[device_id] = Device(id=device_id, type=type_map[data["meta_data"]["type"]], bridge=None, **data)
+            elif device.data != data["data"]:
+                changed = device.update_data(data["data"])
+                mqtt_client.publish("event/{}/getBrightness".format(device_id), json.dumps({"changed": changed}), "event")
+
+
+def run_shard(shard: int, endpoints: list, outbound, inbound: dict, lights: int):
+    threads = list()
+    for endpoint in endpoints:
+        proxy = ProxyMQTTClient(endpoint=endpoint, outbound=outbound, inbound=inbound[endpoint])
+        threads.append(threading.Thread(target=poll_loop, args=(proxy, lights), daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class FakeMQTTClient:
+    def __init__(self):
+        self.published = 0
+        self.on_connect = None
+        self.on_message = None
+
+    def publish(self, topic, payload, msg_cls):
+        self.published += 1
+
+    def add_subscription(self, topic, qos):
+        pass
+
+    def connected(self):
+        return False
+
+    def start(self):
+        pass
+
+
+def measure(bridges: int, shards: int, lights: int, duration: float) -> float:
+    context = multiprocessing.get_context("spawn")
+    outbound = [context.Queue() for _ in range(shards)]
+    inbound = {endpoint: context.Queue() for endpoint in range(bridges)}
+    mqtt_client = FakeMQTTClient()
+    frontend = MQTTFrontend(mqtt_client=mqtt_client, outbound=outbound, inbound=inbound)
+    frontend.start()
+    endpoints = [list(range(bridges))[shard::shards] for shard in range(shards)]
+    supervisor = Supervisor(
+        target=run_shard,
+        shards=[(shard_endpoints, outbound[shard], {endpoint: inbound[endpoint] for endpoint in shard_endpoints}, lights) for shard, shard_endpoints in enumerate(endpoints)]
+    )
+    supervisor.start()
+    # skip process start up
+    time.sleep(2)
+    start_count = mqtt_client.published
+    time.sleep(duration)
+    count = mqtt_client.published - start_count
+    supervisor.stop()
+    return count / duration
+
+
+def main():
+    bridges = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    lights = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    logging.disable(logging.INFO)
+    print("{:<8}{:>14}".format("shards", "events/s"))
+    shards = 1
+    while shards <= bridges:
+        print("{:<8}{:>14.0f}".format(shards, measure(bridges, shards, lights, duration)))
+        shards *= 2
+
+
+if __name__ == '__main__':
+    main()
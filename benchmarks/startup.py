@@ -0,0 +1,74 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# Measures import time and peak RSS of the connector's startup imports in fresh interpreters. Pass a file to
+# append the result as a JSON line, to track it over releases.
+#
+#   python -m benchmarks.startup [runs] [results file]
+
+
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# same imports as dc.py
+probe = """
+import resource, sys, time, json
+start = time.perf_counter()
+from util import init_logger, Conf, MQTTClient, handle_sigterm, delay_start, Router, msg_class, timers, SamplingProfiler, gen_profile_topic
+from hue_bridge import HueBridge, Monitor, Controller, backend_map
+import mgw_dc
+duration = time.perf_counter() - start
+print(json.dumps({
+    "import_time": duration,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "lazy": [name for name in ("rgbxy", "subprocess", "hue_bridge.entertainment") if name not in sys.modules]
+}))
+"""
+
+
+def run_probe() -> dict:
+    output = subprocess.check_output([sys.executable, "-c", probe], cwd=root, env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (root, os.environ.get("PYTHONPATH"))))))
+    return json.loads(output)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    results = [run_probe() for _ in range(runs)]
+    summary = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "import_time_median": statistics.median(result["import_time"] for result in results),
+        "import_time_min": min(result["import_time"] for result in results),
+        "max_rss_kb": max(result["max_rss_kb"] for result in results),
+        "modules": results[0]["modules"],
+        "lazy": results[0]["lazy"]
+    }
+    print(json.dumps(summary, indent=4))
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "a") as file:
+            file.write(json.dumps(summary) + "\n")
+
+
+if __name__ == '__main__':
+    main()
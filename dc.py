@@ -15,23 +15,15 @@
 """
 
 
-from util import init_logger, Conf, MQTTClient, handle_sigterm, delay_start, Router
-from hue_bridge import HueBridge, Monitor, Controller
+from util import init_logger, Conf, MQTTClient, handle_sigterm, delay_start, Router, msg_class, timers, SamplingProfiler, gen_profile_topic
+from hue_bridge import HueBridge, Monitor, Controller, backend_map
+import threading
 import signal
+import mgw_dc
 
 
-if __name__ == '__main__':
-    signal.signal(signal.SIGTERM, handle_sigterm)
-    signal.signal(signal.SIGINT, handle_sigterm)
-    conf = Conf()
-    if not all((conf.Bridge.id, conf.Bridge.api_key)):
-        exit('Please provide Hue Bridge information')
-    if not all((conf.Senergy.dt_extended_color_light, conf.Senergy.dt_on_off_plug_in_unit, conf.Senergy.dt_color_light)):
-        exit('Please provide a SENERGY device types')
-    if conf.StartDelay.enabled:
-        delay_start(conf.StartDelay.min, conf.StartDelay.max)
-    init_logger(conf.Logger.level)
-    type_map = {
+def get_type_map(conf: Conf) -> dict:
+    return {
         "Extended color light": conf.Senergy.dt_extended_color_light,
         "Color light": conf.Senergy.dt_color_light,
         "Color temperature light": conf.Senergy.dt_color_temperature_light,
@@ -40,43 +32,214 @@ if __name__ == '__main__':
         "ZLLSwitch": conf.Senergy.dt_zll_switch,
         "ZLLPresence": conf.Senergy.dt_zll_presence
     }
-    try:
-        device_pool = dict()
-        mqtt_client = MQTTClient(
-            host=conf.MsgBroker.host,
-            port=conf.MsgBroker.port,
-            client_id=conf.Client.id,
-            clean_session=conf.Client.clean_session,
-            keep_alive=conf.Client.keep_alive,
-            sub_lvl_logger=conf.Logger.enable_mqtt
-        )
-        hue_bridge = HueBridge(
-            id=conf.Bridge.id,
-            api_key=conf.Bridge.api_key,
-            nupnp_url=conf.Discovery.nupnp_url,
-            ip_file=conf.Discovery.ip_file,
-            request_timeout=conf.Discovery.timeout,
-            delay=conf.Discovery.delay,
-            check_delay=conf.Discovery.check_delay,
-            check_fail_safe=conf.Discovery.check_fail_safe
-        )
-        hue_bridge.start_discovery()
-        bridge_monitor = Monitor(
+
+
+def get_bridges(conf: Conf) -> list:
+    # SUPERVISOR_BRIDGES: "<id>:<api key>,<id>:<api key>,..."
+    return [tuple(item.strip().split(":", 1)) for item in conf.Supervisor.bridges.split(",") if item.strip()]
+
+
+def init_process(conf: Conf) -> SamplingProfiler:
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.signal(signal.SIGINT, handle_sigterm)
+    init_logger(conf.Logger.level, conf.Logger.json_format, conf.Logger.rate_limit)
+    timers.enabled = conf.Profiler.stage_timers
+    profiler = SamplingProfiler(
+        directory=conf.Profiler.directory,
+        interval=conf.Profiler.interval,
+        max_duration=conf.Profiler.max_duration
+    )
+    signal.signal(signal.SIGUSR1, profiler.handle_signal)
+    return profiler
+
+
+def create_mqtt_client(conf: Conf) -> MQTTClient:
+    return MQTTClient(
+        host=conf.MsgBroker.host,
+        port=conf.MsgBroker.port,
+        client_id=conf.Client.id,
+        clean_session=conf.Client.clean_session,
+        keep_alive=conf.Client.keep_alive,
+        sub_lvl_logger=conf.Logger.enable_mqtt,
+        qos={
+            msg_class.event: conf.Client.qos_events,
+            msg_class.response: conf.Client.qos_responses,
+            msg_class.device_manager: conf.Client.qos_device_manager
+        },
+        max_inflight=conf.Client.max_inflight,
+        max_queued=conf.Client.max_queued,
+        buffer_size=conf.Client.buffer_size,
+        buffer_policy=conf.Client.buffer_policy,
+        reconnect_delay_min=conf.Client.reconnect_delay_min,
+        reconnect_delay_max=conf.Client.reconnect_delay_max,
+        dispatchers=conf.Client.dispatchers
+    )
+
+
+def start_connector(conf: Conf, bridge_id: str, api_key: str, mqtt_client, profiler: SamplingProfiler, entertainment: bool = True):
+    device_pool = dict()
+    recorder = None
+    if conf.Recorder.enabled:
+        from util import Recorder
+        recorder = Recorder(directory=conf.Recorder.directory, name=bridge_id, max_size=conf.Recorder.max_size)
+    hue_bridge = HueBridge(
+        id=bridge_id,
+        api_key=api_key,
+        nupnp_url=conf.Discovery.nupnp_url,
+        ip_file=conf.Discovery.ip_file,
+        request_timeout=conf.Discovery.timeout,
+        delay=conf.Discovery.delay,
+        check_delay=conf.Discovery.check_delay,
+        breaker_threshold=conf.Discovery.breaker_threshold,
+        breaker_reset=conf.Discovery.breaker_reset,
+        read_batch_window=conf.Discovery.read_batch_window,
+        api_version=conf.Bridge.api_version
+    )
+    hue_bridge.start_discovery()
+    bridge_monitor = Monitor(
+        hue_bridge=hue_bridge,
+        mqtt_client=mqtt_client,
+        device_pool=device_pool,
+        type_map=get_type_map(conf),
+        query_delay=conf.Discovery.device_query_delay,
+        request_timeout=conf.Discovery.timeout,
+        device_id_prefix=conf.Discovery.device_id_prefix,
+        dc_id=conf.Client.id,
+        raw_parser=conf.Discovery.raw_poll_parser,
+        event_debounce=conf.Events.debounce,
+        event_batch=conf.Events.batch,
+        stats_interval=conf.Events.stats_interval,
+        refresh_batch_size=conf.Discovery.refresh_batch_size,
+        refresh_batch_delay=conf.Discovery.refresh_batch_delay,
+        refresh_jitter=conf.Discovery.refresh_jitter,
+        wildcard_commands=conf.Client.wildcard_commands,
+        history_size=conf.History.size,
+        history_total_size=conf.History.total_size,
+        refresh_full=conf.Discovery.refresh_full,
+        recorder=recorder
+    )
+    controller = Controller(
+        device_pool=device_pool,
+        mqtt_client=mqtt_client,
+        worker_queue_size=conf.Commands.worker_queue_size,
+        ttl=conf.Commands.ttl,
+        stats_interval=conf.Commands.stats_interval
+    )
+    topic_callbacks = dict()
+    if entertainment and conf.Entertainment.enabled:
+        if not all((conf.Entertainment.group, conf.Entertainment.client_key)):
+            exit('Please provide entertainment group and client key')
+        if conf.Entertainment.transport == "dtls":
+            try:
+                import mbedtls
+            except ImportError:
+                exit("Streaming via dtls requires 'python-mbedtls' - install it or set the entertainment transport to 'udp'")
+        from hue_bridge import EntertainmentStreamer, gen_stream_topic
+        streamer = EntertainmentStreamer(
             hue_bridge=hue_bridge,
-            mqtt_client=mqtt_client,
-            device_pool=device_pool,
-            type_map=type_map,
-            query_delay=conf.Discovery.device_query_delay,
-            request_timeout=conf.Discovery.timeout,
-            device_id_prefix=conf.Discovery.device_id_prefix,
-            dc_id=conf.Client.id
+            group=conf.Entertainment.group,
+            transport=conf.Entertainment.transport,
+            client_key=conf.Entertainment.client_key,
+            port=conf.Entertainment.port,
+            rate=conf.Entertainment.rate,
+            max_frame_age=conf.Entertainment.max_frame_age,
+            idle_timeout=conf.Entertainment.idle_timeout
+        )
+        topic_callbacks[gen_stream_topic(conf.Client.id)] = streamer.handle_message
+        mqtt_client.add_subscription(gen_stream_topic(conf.Client.id), 0)
+        streamer.start()
+    if conf.Profiler.mqtt_control:
+        topic_callbacks[gen_profile_topic(conf.Client.id)] = profiler.handle_message
+        mqtt_client.add_subscription(gen_profile_topic(conf.Client.id), 1)
+    if conf.Client.wildcard_commands:
+        mqtt_client.add_subscription(mgw_dc.com.gen_command_topic("+"), 1)
+    router = Router(
+        bridge_monitor.schedule_refresh,
+        controller.put_command,
+        topic_callbacks,
+        device_pool if conf.Client.wildcard_commands else None,
+        recorder=recorder
+    )
+    mqtt_client.on_connect = bridge_monitor.schedule_refresh
+    mqtt_client.on_drop = bridge_monitor.forget_announced
+    mqtt_client.on_message = router.route
+    bridge_monitor.start()
+    controller.start()
+    mqtt_client.start()
+
+
+def run_shard(shard: int, bridges: list, outbound, inbound: dict):
+    from util import ProxyMQTTClient
+    conf = Conf()
+    profiler = init_process(conf)
+    threads = list()
+    for endpoint, (bridge_id, api_key) in bridges:
+        proxy = ProxyMQTTClient(endpoint=endpoint, outbound=outbound, inbound=inbound[endpoint])
+        threads.append(
+            threading.Thread(
+                target=start_connector,
+                args=(conf, bridge_id, api_key, proxy, profiler, False),
+                name="connector-{}".format(bridge_id),
+                daemon=True
+            )
         )
-        controller = Controller(device_pool=device_pool, mqtt_client=mqtt_client)
-        router = Router(bridge_monitor.schedule_refresh, controller.put_command)
-        mqtt_client.on_connect = bridge_monitor.schedule_refresh
-        mqtt_client.on_message = router.route
-        bridge_monitor.start()
-        controller.start()
-        mqtt_client.start()
-    finally:
-        pass
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def start_supervisor(conf: Conf):
+    from util import MQTTFrontend, Supervisor
+    import multiprocessing
+    bridges = get_bridges(conf)
+    shard_count = min(conf.Supervisor.shards or len(bridges), len(bridges))
+    context = multiprocessing.get_context("spawn")
+    # one outbound queue per shard, a killed shard can't wedge the traffic of the others
+    outbound = [context.Queue() for _ in range(shard_count)]
+    inbound = {endpoint: context.Queue() for endpoint in range(len(bridges))}
+    shards = [list() for _ in range(shard_count)]
+    for endpoint, bridge in enumerate(bridges):
+        shards[endpoint % shard_count].append((endpoint, bridge))
+    frontend = MQTTFrontend(mqtt_client=create_mqtt_client(conf), outbound=outbound, inbound=inbound)
+
+    def reset_shard(shard: int):
+        # the old process may have died holding a queue lock, the restarted one gets new queues
+        queue = context.Queue()
+        frontend.replace_outbound(outbound[shard], queue)
+        outbound[shard] = queue
+        for endpoint, _ in shards[shard]:
+            inbound[endpoint] = context.Queue()
+            frontend.reset(endpoint, inbound[endpoint])
+        return shards[shard], outbound[shard], {endpoint: inbound[endpoint] for endpoint, _ in shards[shard]}
+
+    supervisor = Supervisor(
+        target=run_shard,
+        shards=[(shard, outbound[num], {endpoint: inbound[endpoint] for endpoint, _ in shard}) for num, shard in enumerate(shards)],
+        restart_delay=conf.Supervisor.restart_delay,
+        on_restart=reset_shard
+    )
+    supervisor.start()
+    frontend.start()
+
+
+if __name__ == '__main__':
+    conf = Conf()
+    if conf.Supervisor.bridges:
+        if not get_bridges(conf) or not all(len(bridge) == 2 and all(bridge) for bridge in get_bridges(conf)):
+            exit('Please provide Hue Bridge information as <id>:<api key>,...')
+        if conf.Entertainment.enabled:
+            exit('Entertainment streaming is not available in supervisor mode')
+    elif not all((conf.Bridge.id, conf.Bridge.api_key)):
+        exit('Please provide Hue Bridge information')
+    if conf.Bridge.api_version not in backend_map:
+        exit('Please provide a supported Hue Bridge API version ({})'.format(", ".join(backend_map)))
+    if not all((conf.Senergy.dt_extended_color_light, conf.Senergy.dt_on_off_plug_in_unit, conf.Senergy.dt_color_light)):
+        exit('Please provide a SENERGY device types')
+    if conf.StartDelay.enabled:
+        delay_start(conf.StartDelay.min, conf.StartDelay.max)
+    profiler = init_process(conf)
+    if conf.Supervisor.bridges:
+        start_supervisor(conf)
+    else:
+        start_connector(conf, conf.Bridge.id, conf.Bridge.api_key, create_mqtt_client(conf), profiler)
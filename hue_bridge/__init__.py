@@ -14,16 +14,33 @@
    limitations under the License.
 """
 
-from .controller import *
-from .device import *
-from .discovery import *
-from .monitor import *
-from .service import *
-
-__all__ = (
-    controller.__all__,
-    device.__all__,
-    discovery.__all__,
-    monitor.__all__,
-    service.__all__
-)
+import importlib
+
+
+# submodules are imported on first attribute access (PEP 562), optional subsystems like entertainment
+# streaming are only loaded when used
+_exports = {
+    "backend": ("V1Backend", "V2Backend", "backend_map"),
+    "controller": ("Controller", ),
+    "device": ("Device", "DeviceData", "MetaData", "State", "Config"),
+    "discovery": ("HueBridge", ),
+    "entertainment": ("EntertainmentStreamer", "UDPTransport", "DTLSTransport", "transport_map", "gen_stream_topic"),
+    "monitor": ("Monitor", ),
+    "service": ("service_map", "event_service_map", "set_services", "cache_services", "coalesce_services")
+}
+
+_modules = {name: module for module, names in _exports.items() for name in names}
+
+__all__ = tuple(_modules)
+
+
+def __getattr__(name):
+    if name not in _modules:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+    value = getattr(importlib.import_module("." + _modules[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,244 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+__all__ = ("V1Backend", "V2Backend", "backend_map")
+
+
+from .discovery import HueBridge
+import threading
+import typing
+import requests
+
+
+def put(bridge: HueBridge, path: str, payload: dict):
+    if not bridge.breaker.allow():
+        return 1, "hue bridge not reachable - circuit open"
+    try:
+        resp = requests.put(
+            url=f"https://{bridge.host}/api/{bridge.api_key}/{path}",
+            json=payload,
+            verify=False,
+            timeout=bridge.request_timeout
+        )
+    except Exception as ex:
+        bridge.failure(reachable=False)
+        return 1, "could not send request to hue bridge - {}".format(ex)
+    if resp.status_code >= 500:
+        bridge.failure()
+    else:
+        bridge.success()
+    try:
+        if resp.status_code == 200:
+            resp = resp.json()
+            if isinstance(resp, list):
+                for item in resp:
+                    if "error" in item:
+                        return 1, item["error"]["description"]
+                return 0, {key: value for item in resp for key, value in item.get("success", {}).items()}
+            else:
+                return 1, "unknown error"
+        else:
+            return 1, resp.status_code
+    except Exception as ex:
+        return 1, "could not parse response of hue bridge - {}".format(ex)
+
+
+def get(bridge: HueBridge, path: str):
+    if not bridge.breaker.allow():
+        return 1, "hue bridge not reachable - circuit open"
+    try:
+        resp = requests.get(
+            url=f"https://{bridge.host}/api/{bridge.api_key}/{path}",
+            verify=False,
+            timeout=bridge.request_timeout
+        )
+    except Exception as ex:
+        bridge.failure(reachable=False)
+        return 1, "could not send request to hue bridge - {}".format(ex)
+    if resp.status_code >= 500:
+        bridge.failure()
+    else:
+        bridge.success()
+    try:
+        if resp.status_code == 200:
+            resp = resp.json()
+            if isinstance(resp, dict):
+                return 0, resp
+            elif isinstance(resp, list):
+                return 1, resp[0]["error"]["description"]
+            else:
+                return 1, "unknown error"
+        else:
+            return 1, resp.status_code
+    except Exception as ex:
+        return 1, "could not parse response of hue bridge - {}".format(ex)
+
+
+def request_v2(bridge: HueBridge, method: str, resource: str, payload: typing.Optional[dict] = None):
+    if not bridge.breaker.allow():
+        return 1, "hue bridge not reachable - circuit open"
+    try:
+        resp = requests.request(
+            method=method,
+            url=f"https://{bridge.host}/clip/v2/resource/{resource}",
+            headers={"hue-application-key": bridge.api_key},
+            json=payload,
+            verify=False,
+            timeout=bridge.request_timeout
+        )
+    except Exception as ex:
+        bridge.failure(reachable=False)
+        return 1, "could not send request to hue bridge - {}".format(ex)
+    if resp.status_code >= 500:
+        bridge.failure()
+    else:
+        bridge.success()
+    try:
+        body = resp.json()
+        if body.get("errors"):
+            return 1, "; ".join(error["description"] for error in body["errors"])
+        if resp.status_code == 200:
+            return 0, body["data"]
+        return 1, resp.status_code
+    except Exception as ex:
+        if resp.status_code != 200:
+            return 1, resp.status_code
+        return 1, "could not parse response of hue bridge - {}".format(ex)
+
+
+def state_to_v2(state: dict) -> dict:
+    body = dict()
+    if "on" in state:
+        body["on"] = {"on": state["on"]}
+    if "bri" in state:
+        body["dimming"] = {"brightness": min(round(state["bri"] * 100 / 254, 2), 100)}
+    if "xy" in state:
+        body["color"] = {"xy": {"x": state["xy"][0], "y": state["xy"][1]}}
+    if "ct" in state:
+        body["color_temperature"] = {"mirek": state["ct"]}
+    if "transitiontime" in state:
+        body["dynamics"] = {"duration": state["transitiontime"] * 100}
+    return body
+
+
+def state_from_v2(resource: dict) -> dict:
+    state = {"on": resource["on"]["on"], "reachable": True}
+    if "dimming" in resource:
+        state["bri"] = min(max(round(resource["dimming"]["brightness"] * 254 / 100), 1), 254)
+    if "color" in resource:
+        state["xy"] = [resource["color"]["xy"]["x"], resource["color"]["xy"]["y"]]
+    if resource.get("color_temperature", {}).get("mirek") is not None:
+        state["ct"] = resource["color_temperature"]["mirek"]
+    return state
+
+
+class V1Backend:
+    def __init__(self, bridge: HueBridge):
+        self.__bridge = bridge
+
+    def get_light(self, number: str):
+        return get(self.__bridge, f"lights/{number}")
+
+    def get_lights(self):
+        return get(self.__bridge, "lights")
+
+    def set_light_state(self, number: str, state: dict):
+        return put(self.__bridge, f"lights/{number}/state", state)
+
+    def set_group_action(self, group: str, action: dict):
+        return put(self.__bridge, f"groups/{group}/action", action)
+
+
+class V2Backend:
+    """
+    CLIP v2 backend. Takes and returns v1 shaped states and success maps so services and the device model stay
+    unchanged, v1 numbers are mapped to v2 ids via the id_v1 field of the resources.
+    """
+
+    def __init__(self, bridge: HueBridge):
+        self.__bridge = bridge
+        self.__ids = dict()
+        self.__lock = threading.Lock()
+
+    def __update_ids(self, rtype: str, resources: typing.List[dict]):
+        with self.__lock:
+            for resource in resources:
+                if resource.get("id_v1"):
+                    self.__ids[(rtype, resource["id_v1"])] = resource["id"]
+
+    def __resolve(self, rtype: str, id_v1: str):
+        rid = self.__ids.get((rtype, id_v1))
+        if rid is None:
+            err, body = request_v2(self.__bridge, "GET", rtype)
+            if err:
+                return err, body
+            self.__update_ids(rtype, body)
+            rid = self.__ids.get((rtype, id_v1))
+            if rid is None:
+                return 1, "resource, {}, not available".format(id_v1)
+        return 0, rid
+
+    def get_light(self, number: str):
+        err, rid = self.__resolve("light", f"/lights/{number}")
+        if err:
+            return err, rid
+        err, body = request_v2(self.__bridge, "GET", f"light/{rid}")
+        if err:
+            return err, body
+        return 0, {"state": state_from_v2(body[0])}
+
+    def get_lights(self):
+        err, body = request_v2(self.__bridge, "GET", "light")
+        if err:
+            return err, body
+        self.__update_ids("light", body)
+        return 0, {resource["id_v1"].rsplit("/", 1)[-1]: {"state": state_from_v2(resource)} for resource in body if resource.get("id_v1")}
+
+    def set_light_state(self, number: str, state: dict):
+        err, rid = self.__resolve("light", f"/lights/{number}")
+        if err:
+            return err, rid
+        err, body = request_v2(self.__bridge, "PUT", f"light/{rid}", state_to_v2(state))
+        if err:
+            return err, body
+        return 0, {f"/lights/{number}/state/{key}": value for key, value in state.items()}
+
+    def set_group_action(self, group: str, action: dict):
+        action = dict(action)
+        scene = action.pop("scene", None)
+        if scene is not None:
+            err, rid = self.__resolve("scene", f"/scenes/{scene}")
+            if err:
+                return err, rid
+            payload = {"recall": {"action": "active"}}
+            if "transitiontime" in action:
+                payload["recall"]["duration"] = action["transitiontime"] * 100
+            err, body = request_v2(self.__bridge, "PUT", f"scene/{rid}", payload)
+        else:
+            err, rid = self.__resolve("grouped_light", f"/groups/{group}")
+            if err:
+                return err, rid
+            err, body = request_v2(self.__bridge, "PUT", f"grouped_light/{rid}", state_to_v2(action))
+        if err:
+            return err, body
+        return 0, {f"/groups/{group}/action/{key}": value for key, value in action.items()}
+
+
+backend_map = {
+    "v1": V1Backend,
+    "v2": V2Backend
+}
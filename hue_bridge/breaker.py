@@ -0,0 +1,83 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+__all__ = ("CircuitBreaker", "breaker_state")
+
+
+from util import get_logger
+import threading
+import time
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class breaker_state:
+    closed = "closed"
+    open = "open"
+    half_open = "half-open"
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold consecutive failures and rejects requests until reset_timeout has passed. Afterwards a
+    single probe request is allowed (half-open), its result closes or reopens the circuit.
+    """
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float):
+        self.__name = name
+        self.__threshold = threshold
+        self.__reset_timeout = reset_timeout
+        self.__state = breaker_state.closed
+        self.__failures = 0
+        self.__opened = 0
+        self.__probing = False
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self.__state
+
+    def allow(self) -> bool:
+        with self.__lock:
+            if self.__state == breaker_state.closed:
+                return True
+            if self.__state == breaker_state.open and time.monotonic() - self.__opened >= self.__reset_timeout:
+                logger.info("'{}' half-open - probing".format(self.__name))
+                self.__state = breaker_state.half_open
+                self.__probing = False
+            if self.__state == breaker_state.half_open and not self.__probing:
+                self.__probing = True
+                return True
+            return False
+
+    def success(self):
+        with self.__lock:
+            if self.__state != breaker_state.closed:
+                logger.info("'{}' closed".format(self.__name))
+            self.__state = breaker_state.closed
+            self.__failures = 0
+            self.__probing = False
+
+    def failure(self):
+        with self.__lock:
+            self.__failures += 1
+            if self.__state == breaker_state.half_open or (self.__state == breaker_state.closed and self.__failures >= self.__threshold):
+                logger.warning("'{}' open after {} failures".format(self.__name, self.__failures))
+                self.__state = breaker_state.open
+                self.__opened = time.monotonic()
+                self.__probing = False
@@ -0,0 +1,102 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+__all__ = ("CommandQueue", )
+
+
+import threading
+import typing
+import heapq
+import queue
+import time
+
+
+class CommandQueue:
+    """
+    Bounded priority queue. Items with a lower priority value are returned first, items of equal priority in
+    insertion order. Every item gets a deadline of ttl seconds, items returned after their deadline are flagged
+    as expired and must not be executed. An item put with the key of a still queued item replaces that item, the
+    replaced item is returned by put. The new item takes the old one's place only if no other item was queued
+    after it, otherwise it is queued last so that it is not executed before items that were put earlier.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.__maxsize = maxsize
+        self.__ttl = ttl
+        self.__heap = list()
+        self.__count = 0
+        self.__cond = threading.Condition(threading.Lock())
+        self.__expired = 0
+        self.__rejected = 0
+        self.__superseded = 0
+        self.__keys = dict()
+        self.__last = None
+
+    def put(self, item, priority: int, key: typing.Optional[typing.Hashable] = None) -> typing.Any:
+        with self.__cond:
+            superseded = None
+            if key is not None and key in self.__keys:
+                entry = self.__keys.pop(key)
+                superseded = entry[3]
+                self.__superseded += 1
+                if entry is self.__last and entry[0] == priority:
+                    entry[2] = time.monotonic() + self.__ttl
+                    entry[3] = item
+                    self.__keys[key] = entry
+                    return superseded
+                self.__heap.remove(entry)
+                heapq.heapify(self.__heap)
+            if self.__maxsize > 0 and len(self.__heap) >= self.__maxsize:
+                self.__rejected += 1
+                raise queue.Full
+            entry = [priority, self.__count, time.monotonic() + self.__ttl, item, key]
+            heapq.heappush(self.__heap, entry)
+            if key is not None:
+                self.__keys[key] = entry
+            self.__last = entry
+            self.__count += 1
+            self.__cond.notify()
+            return superseded
+
+    def get(self, timeout: float) -> typing.Tuple[typing.Any, bool]:
+        with self.__cond:
+            if not self.__cond.wait_for(lambda: self.__heap, timeout=timeout):
+                raise queue.Empty
+            entry = heapq.heappop(self.__heap)
+            _, _, deadline, item, key = entry
+            if key is not None:
+                del self.__keys[key]
+            if entry is self.__last:
+                self.__last = None
+            if time.monotonic() > deadline:
+                self.__expired += 1
+                return item, True
+            return item, False
+
+    def qsize(self) -> int:
+        with self.__cond:
+            return len(self.__heap)
+
+    @property
+    def stats(self) -> dict:
+        with self.__cond:
+            return {
+                "depth": len(self.__heap),
+                "expired": self.__expired,
+                "rejected": self.__rejected,
+                "superseded": self.__superseded
+            }
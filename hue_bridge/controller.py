@@ -18,9 +18,10 @@
 __all__ = ("Controller", )
 
 
-from util import get_logger, MQTTClient
+from util import get_logger, MQTTClient, msg_class, timers
 from .device import Device
-from .service import service_map
+from .service import service_map, set_services, cache_services, coalesce_services
+from .command_queue import CommandQueue
 import threading
 import queue
 import time
@@ -31,108 +32,193 @@ import mgw_dc
 logger = get_logger(__name__.split(".", 1)[-1])
 
 
+def get_priority(srv_id: str) -> int:
+    return 0 if srv_id in set_services else 1
+
+
+def send_response(mqtt_client: MQTTClient, dev_id: str, srv_id: str, cmd_id: str, data: dict):
+    mqtt_client.publish(
+        topic=mgw_dc.com.gen_response_topic(dev_id, srv_id),
+        payload=json.dumps(mgw_dc.com.gen_response_msg(cmd_id, json.dumps(data))),
+        msg_cls=msg_class.response
+    )
+
+
+def reject_command(mqtt_client: MQTTClient, cmd: tuple, reason: str):
+    dev_id, srv_id, payload = cmd
+    try:
+        cmd_id = json.loads(payload)[mgw_dc.com.command.id]
+        logger.warning("dropping command '%s' for '%s' - %s", cmd_id, dev_id, reason)
+        send_response(mqtt_client, dev_id, srv_id, cmd_id, {"status": 1})
+    except Exception as ex:
+        logger.error("could not reject command for '%s' - %s", dev_id, ex)
+
+
+def execute_command(name: str, device: Device, mqtt_client: MQTTClient, command: tuple, stage: str = "worker.service"):
+    dev_id, srv_id, cmd = command
+    logger.debug("%s: '%s' <- '%s'", name, srv_id, cmd)
+    cmd = json.loads(cmd)
+    try:
+        with timers.measure(stage):
+            if cmd.get(mgw_dc.com.command.data):
+                data = service_map[srv_id](device, **json.loads(cmd[mgw_dc.com.command.data]))
+            else:
+                data = service_map[srv_id](device)
+    except KeyError as ex:
+        logger.error("%s: unknown service - %s", name, ex)
+        data = {"status": 1}
+    except json.JSONDecodeError as ex:
+        logger.error("%s: could not parse command - %s", name, ex)
+        data = {"status": 1}
+    except ValueError as ex:
+        logger.error("%s: bad service arguments - %s", name, ex)
+        data = {"status": 1}
+    except TypeError as ex:
+        logger.error("%s: calling service failed or bad response - %s", name, ex)
+        data = {"status": 1}
+    logger.debug("%s: '%s'", name, data)
+    try:
+        send_response(mqtt_client, dev_id, srv_id, cmd[mgw_dc.com.command.id], data)
+    except Exception as ex:
+        logger.error(
+            "%s: could not send response for '%s' - %s",
+            name,
+            cmd[mgw_dc.com.command.id],
+            ex
+        )
+
+
 class Worker(threading.Thread):
-    def __init__(self, device: Device, mqtt_client: MQTTClient):
+    def __init__(self, device: Device, mqtt_client: MQTTClient, queue_size: int, ttl: int):
         super().__init__(name="worker-{}".format(device.id), daemon=True)
         self.__device = device
         self.__mqtt_client = mqtt_client
         self.__stop = False
-        self.__command_queue = queue.Queue()
+        self.__command_queue = CommandQueue(maxsize=queue_size, ttl=ttl)
 
     def run(self) -> None:
-        logger.debug("{}: starting ...".format(self.name))
+        logger.debug("%s: starting ...", self.name)
         while not self.__stop:
             try:
-                dev_id, srv_id, cmd = self.__command_queue.get(timeout=30)
-                logger.debug("{}: '{}' <- '{}'".format(self.name, srv_id, cmd))
-                cmd = json.loads(cmd)
-                try:
-                    if cmd.get(mgw_dc.com.command.data):
-                        data = service_map[srv_id](self.__device, **json.loads(cmd[mgw_dc.com.command.data]))
-                    else:
-                        data = service_map[srv_id](self.__device)
-                    resp_msg = mgw_dc.com.gen_response_msg(cmd[mgw_dc.com.command.id], json.dumps(data))
-                except KeyError as ex:
-                    logger.error("{}: unknown service - {}".format(self.name, ex))
-                    resp_msg = mgw_dc.com.gen_response_msg(cmd[mgw_dc.com.command.id], json.dumps({"status": 1}))
-                except json.JSONDecodeError as ex:
-                    logger.error("{}: could not parse command - {}".format(self.name, ex))
-                    resp_msg = mgw_dc.com.gen_response_msg(cmd[mgw_dc.com.command.id], json.dumps({"status": 1}))
-                except TypeError as ex:
-                    logger.error("{}: calling service failed or bad response - {}".format(self.name, ex))
-                    resp_msg = mgw_dc.com.gen_response_msg(cmd[mgw_dc.com.command.id], json.dumps({"status": 1}))
-                logger.debug("{}: '{}'".format(self.name, resp_msg))
-                try:
-                    self.__mqtt_client.publish(
-                        topic=mgw_dc.com.gen_response_topic(dev_id, srv_id),
-                        payload=json.dumps(resp_msg),
-                        qos=1
-                    )
-                except Exception as ex:
-                    logger.error(
-                        "{}: could not send response for '{}' - {}".format(
-                            self.name,
-                            cmd[mgw_dc.com.command.id],
-                            ex
-                        )
-                    )
+                (dev_id, srv_id, cmd), expired = self.__command_queue.get(timeout=30)
+                if expired:
+                    reject_command(self.__mqtt_client, (dev_id, srv_id, cmd), "deadline exceeded")
+                    continue
+                execute_command(self.name, self.__device, self.__mqtt_client, (dev_id, srv_id, cmd))
             except queue.Empty:
                 pass
             except Exception as ex:
-                logger.error("{}: command execution failed - {}".format(self.name, ex))
+                logger.error("%s: command execution failed - %s", self.name, ex)
         del self.__device
         del self.__mqtt_client
         del self.__command_queue
-        logger.debug("'{}': quit".format(self.name))
+        logger.debug("'%s': quit", self.name)
 
     def stop(self):
         self.__stop = True
 
     def execute(self, command):
-        self.__command_queue.put_nowait(command)
+        # a queued fade that is not yet sent is replaced by a newer command of the same service
+        superseded = self.__command_queue.put(
+            command,
+            get_priority(command[1]),
+            command[1] if command[1] in coalesce_services else None
+        )
+        if superseded:
+            reject_command(self.__mqtt_client, superseded, "superseded by newer '{}'".format(command[1]))
+
+    @property
+    def stats(self) -> dict:
+        return self.__command_queue.stats
 
 
 class Controller(threading.Thread):
-    def __init__(self, device_pool: dict, mqtt_client: MQTTClient):
+    def __init__(self, device_pool: dict, mqtt_client: MQTTClient, worker_queue_size: int = 50, ttl: int = 30, stats_interval: int = 300):
         super().__init__(name="controller", daemon=True)
         self.__device_pool = device_pool
         self.__mqtt_client = mqtt_client
-        self.__command_queue = queue.Queue()
+        self.__worker_queue_size = worker_queue_size
+        self.__ttl = ttl
+        self.__stats_interval = stats_interval
         self.__worker_pool = dict()
+        self.__lock = threading.Lock()
+        self.__retired_stats = {"expired": 0, "rejected": 0, "superseded": 0}
+        self.__unknown = 0
+        self.__inline = 0
+        self.__queued = 0
 
     def run(self):
         garbage_collector_time = time.time()
+        stats_time = time.time()
         while True:
+            time.sleep(10)
             try:
-                cmd = self.__command_queue.get(timeout=30)
-                try:
-                    device = self.__device_pool[cmd[0]]
-                    if device.id not in self.__worker_pool:
-                        worker = Worker(device=device, mqtt_client=self.__mqtt_client)
-                        worker.start()
-                        self.__worker_pool[device.id] = worker
-                    else:
-                        worker = self.__worker_pool[device.id]
-                    worker.execute(cmd)
-                except KeyError:
-                    logger.error("received command for unknown device '{}'".format(cmd[0]))
-                except Exception as ex:
-                    logger.error("routing command to worker failed - {}".format(ex))
-            except queue.Empty:
-                try:
-                    if time.time() - garbage_collector_time > 120:
-                        self.__collectGarbage()
-                        garbage_collector_time = time.time()
-                except Exception as ex:
-                    logger.error("collecting garbage workers failed - {}".format(ex))
+                if time.time() - garbage_collector_time > 120:
+                    self.__collectGarbage()
+                    garbage_collector_time = time.time()
+            except Exception as ex:
+                logger.error("collecting garbage workers failed - %s", ex)
+            if self.__stats_interval and time.time() - stats_time > self.__stats_interval:
+                logger.info("command queues: %s", self.stats)
+                logger.info("mqtt: %s", self.__mqtt_client.stats)
+                self.__mqtt_client.measure_keepalive()
+                if timers.enabled:
+                    logger.info("stages: %s", timers.stats)
+                stats_time = time.time()
 
     def __collectGarbage(self):
-        garbage_workers = set(self.__worker_pool) - set(self.__device_pool)
-        for worker_id in garbage_workers:
-            worker = self.__worker_pool[worker_id]
-            logger.debug("stopping '{}'".format(worker.name))
-            worker.stop()
-            del self.__worker_pool[worker_id]
+        with self.__lock:
+            garbage_workers = set(self.__worker_pool) - set(self.__device_pool)
+            for worker_id in garbage_workers:
+                worker = self.__worker_pool.pop(worker_id)
+                logger.debug("stopping '%s'", worker.name)
+                worker.stop()
+                for key in self.__retired_stats:
+                    self.__retired_stats[key] += worker.stats[key]
+
+    def __get_worker(self, dev_id: str) -> Worker:
+        with self.__lock:
+            worker = self.__worker_pool.get(dev_id)
+            if not worker:
+                worker = Worker(device=self.__device_pool[dev_id], mqtt_client=self.__mqtt_client, queue_size=self.__worker_queue_size, ttl=self.__ttl)
+                worker.start()
+                self.__worker_pool[dev_id] = worker
+            return worker
 
     def put_command(self, cmd: tuple):
-        self.__command_queue.put_nowait(cmd)
+        # called by the router, cache-only services are answered right away, others are handed to the device's worker
+        if cmd[1] in cache_services:
+            try:
+                device = self.__device_pool[cmd[0]]
+            except KeyError:
+                self.__unknown += 1
+                logger.error("received command for unknown device '%s'", cmd[0])
+                return
+            self.__inline += 1
+            execute_command(self.name, device, self.__mqtt_client, cmd, stage="controller.inline")
+            return
+        self.__queued += 1
+        worker = self.__worker_pool.get(cmd[0])
+        try:
+            if not worker:
+                worker = self.__get_worker(cmd[0])
+            worker.execute(cmd)
+        except queue.Full:
+            reject_command(self.__mqtt_client, cmd, "queue of '{}' full".format(worker.name))
+        except KeyError:
+            self.__unknown += 1
+            logger.error("received command for unknown device '%s'", cmd[0])
+
+    @property
+    def stats(self) -> dict:
+        workers = {"depth": 0, **self.__retired_stats}
+        for worker in list(self.__worker_pool.values()):
+            for key, value in worker.stats.items():
+                workers[key] += value
+        return {
+            "workers": len(self.__worker_pool),
+            "unknown_device": self.__unknown,
+            "inline": self.__inline,
+            "queued": self.__queued,
+            **workers
+        }
@@ -15,57 +15,313 @@
 """
 
 
-__all__ = ("Device", )
+__all__ = ("Device", "DeviceData", "MetaData", "State", "Config")
 
 
 from .discovery import HueBridge
+import typing
 import mgw_dc
+import time
+
+
+# state keys a transition fades, polled values of these are intermediate until the transition is over
+fade_keys = frozenset({"bri", "xy", "ct", "hue", "sat"})
+
+
+class _Fields:
+    """
+    Compact mapping-like container. Known keys are stored in slots, unknown keys fall back to a lazily created dict.
+    Updates are applied in place and report the keys that changed.
+    """
+    __slots__ = ("_extra", )
+    _fields = frozenset()
+
+    def __init__(self, obj: typing.Optional[typing.Mapping] = None):
+        self._extra = None
+        if obj:
+            self.update(obj)
+
+    def update(self, obj: typing.Mapping) -> typing.List[str]:
+        changed = list()
+        for key in self:
+            if key not in obj:
+                self.__delete(key)
+                changed.append(key)
+        for key, value in obj.items():
+            if self.get(key, _unset) != value:
+                self.__set(key, value)
+                changed.append(key)
+        return changed
+
+    def merge(self, obj: typing.Mapping) -> typing.List[str]:
+        changed = list()
+        for key, value in obj.items():
+            if self.get(key, _unset) != value:
+                self.__set(key, value)
+                changed.append(key)
+        return changed
+
+    def get(self, key: str, default=None):
+        if key in self._fields:
+            return getattr(self, key, default)
+        if self._extra:
+            return self._extra.get(key, default)
+        return default
+
+    def copy(self):
+        return type(self)(self)
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+    def keys(self):
+        return iter(self)
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def __set(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = dict()
+            self._extra[key] = value
+
+    def __delete(self, key):
+        if key in self._fields:
+            delattr(self, key)
+        else:
+            del self._extra[key]
+
+    def __getitem__(self, key: str):
+        value = self.get(key, _unset)
+        if value is _unset:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str):
+        return self.get(key, _unset) is not _unset
+
+    def __iter__(self):
+        for key in self.__slots__:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from tuple(self._extra)
+
+    def __len__(self):
+        length = len(self._extra) if self._extra else 0
+        for key in self.__slots__:
+            if hasattr(self, key):
+                length += 1
+        return length
+
+    def __eq__(self, other):
+        if not isinstance(other, (_Fields, dict)):
+            return NotImplemented
+        if len(self) != len(other):
+            return False
+        for key, value in other.items():
+            if self.get(key, _unset) != value:
+                return False
+        return True
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+_unset = object()
+
+
+class State(_Fields):
+    __slots__ = ("on", "bri", "hue", "sat", "xy", "ct", "effect", "alert", "colormode", "mode", "reachable", "presence", "buttonevent", "lastupdated")
+    _fields = frozenset(__slots__)
+    on: bool
+    bri: int
+    hue: int
+    sat: int
+    xy: typing.List[float]
+    ct: int
+    effect: str
+    alert: str
+    colormode: str
+    mode: str
+    reachable: bool
+    presence: bool
+    buttonevent: int
+    lastupdated: str
+
+
+class Config(_Fields):
+    __slots__ = ("on", "reachable", "battery", "alert", "ledindication", "usertest", "sensitivity", "sensitivitymax", "pending")
+    _fields = frozenset(__slots__)
+    on: bool
+    reachable: bool
+    battery: int
+    alert: str
+    ledindication: bool
+    usertest: bool
+    sensitivity: int
+    sensitivitymax: int
+    pending: list
+
+
+class MetaData(_Fields):
+    __slots__ = ("name", "model_id", "type", "manufacturer_name", "sw_version", "number")
+    _fields = frozenset(__slots__)
+    name: str
+    model_id: str
+    type: str
+    manufacturer_name: str
+    sw_version: str
+    number: str
+
+
+class DeviceData:
+    __slots__ = ("state", "config")
+    _sections = ("state", "config")
+
+    def __init__(self, obj: typing.Optional[typing.Mapping] = None):
+        self.state = State(obj.get("state") if obj else None)
+        self.config = Config(obj.get("config") if obj else None)
+
+    def update(self, obj: typing.Mapping) -> typing.Dict[str, typing.List[str]]:
+        return {
+            "state": self.state.update(obj.get("state") or {}),
+            "config": self.config.update(obj.get("config") or {})
+        }
+
+    def get(self, key: str, default=None):
+        if key in self._sections:
+            return getattr(self, key)
+        return default
+
+    def copy(self):
+        return DeviceData(self)
+
+    def items(self):
+        yield "state", self.state
+        yield "config", self.config
+
+    def to_dict(self) -> dict:
+        return {"state": self.state.to_dict(), "config": self.config.to_dict()}
+
+    def __getitem__(self, key: str):
+        if key in self._sections:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def __eq__(self, other):
+        if not isinstance(other, (DeviceData, dict)):
+            return NotImplemented
+        return self.state == (other.get("state") or {}) and self.config == (other.get("config") or {})
+
+    def __repr__(self):
+        return repr(self.to_dict())
 
 
 class Device(mgw_dc.dm.Device):
-    def __init__(self, id: str, type: str, meta_data: dict, data: dict, bridge: HueBridge):
+    def __init__(self, id: str, type: str, meta_data: typing.Mapping, data: typing.Mapping, bridge: HueBridge):
         super().__init__(id, meta_data["name"], type)
+        self.__meta_data = MetaData()
+        self.__data = DeviceData()
         self.meta_data = meta_data
         self.data = data
         self.bridge = bridge
+        self.on_state_applied = None
+        self.history = None
+        self.__fading = dict()
 
     @property
     def number(self):
-        return self.__meta_data["number"]
+        return self.__meta_data.number
 
     @property
     def model_id(self):
-        return self.__meta_data["model_id"]
+        return self.__meta_data.model_id
 
     # @property
     # def api(self):
     #     return self.__meta_data["api"]
 
     @property
-    def meta_data(self) -> dict:
+    def meta_data(self) -> MetaData:
         return self.__meta_data
 
     @meta_data.setter
-    def meta_data(self, obj: dict):
-        self.__meta_data = obj
-        self.name = self.__meta_data["name"]
-        self.attributes = [
-            mgw_dc.dm.gen_attribute("manufacturer", self.__meta_data["manufacturer_name"]),
-            mgw_dc.dm.gen_attribute("model", self.__meta_data["model_id"]),
-            mgw_dc.dm.gen_attribute("firmware", self.__meta_data["sw_version"])
-        ]
+    def meta_data(self, obj: typing.Mapping):
+        changed = self.__meta_data.update(obj)
+        self.name = self.__meta_data.name
+        if {"manufacturer_name", "model_id", "sw_version"}.intersection(changed):
+            self.attributes = [
+                mgw_dc.dm.gen_attribute("manufacturer", self.__meta_data.manufacturer_name),
+                mgw_dc.dm.gen_attribute("model", self.__meta_data.model_id),
+                mgw_dc.dm.gen_attribute("firmware", self.__meta_data.sw_version)
+            ]
 
     @property
-    def data(self) -> dict:
+    def data(self) -> DeviceData:
         return self.__data
 
     @data.setter
-    def data(self, obj: dict):
-        self.__data = obj
-        if self.__data["state"].get("reachable") or self.__data["config"].get("reachable"):
+    def data(self, obj: typing.Mapping):
+        self.update_data(obj)
+
+    def update_data(self, obj: typing.Mapping) -> typing.Dict[str, typing.List[str]]:
+        changed = self.__data.update(obj)
+        if self.__data.state.get("reachable") or self.__data.config.get("reachable"):
             self.state = mgw_dc.dm.device_state.online
         else:
             self.state = mgw_dc.dm.device_state.offline
+        return changed
+
+    def apply_state(self, state: typing.Mapping) -> typing.List[str]:
+        # on_state_applied receives the changed keys, or None if the state is unknown and needs a full query
+        changed = self.__data.state.merge(state)
+        if changed and self.on_state_applied:
+            self.on_state_applied(self, changed)
+        return changed
+
+    def begin_transition(self, duration: float, keys: typing.Iterable[str], grace: float = 1):
+        # grace covers the delay until the bridge reports the final values
+        end = time.monotonic() + duration + grace
+        for key in fade_keys.intersection(keys):
+            self.__fading[key] = max(self.__fading.get(key, 0), end)
+
+    @property
+    def fading(self) -> typing.FrozenSet[str]:
+        if not self.__fading:
+            return frozenset()
+        now = time.monotonic()
+        fading = frozenset(key for key, end in self.__fading.items() if end > now)
+        if len(fading) < len(self.__fading):
+            self.__fading = {key: self.__fading[key] for key in fading}
+        return fading
+
+    @property
+    def in_transition(self) -> bool:
+        return bool(self.fading)
+
+    def mask_transition(self, state: typing.Mapping) -> typing.Mapping:
+        # replaces intermediate values of fading keys in a polled state with the targets of the transition
+        fading = self.fading
+        if not fading:
+            return state
+        if not state.get("on", True) or not state.get("reachable", True):
+            # switched off or lost during the transition
+            self.__fading = dict()
+            return state
+        current = self.__data.state
+        return {**state, **{key: current[key] for key in fading if key in current}}
+
+    def invalidate_state(self):
+        if self.on_state_applied:
+            self.on_state_applied(self, None)
 
     def __str__(self):
         return super().__str__(meta_data=self.meta_data, data=self.data)
@@ -19,9 +19,9 @@ __all__ = ("HueBridge", )
 
 
 from util import get_logger
+from .breaker import CircuitBreaker
 import urllib3
 import threading
-import subprocess
 import time
 import requests
 
@@ -32,6 +32,8 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
 def ping(host) -> bool:
+    # only needed for network scans
+    import subprocess
     return subprocess.call(['ping', '-c', '2', '-t', '2', host], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
 
 
@@ -158,7 +160,7 @@ def validate_hosts(hosts, bridge_id, timeout) -> dict:
 
 
 class HueBridge:
-    def __init__(self, id: str, api_key: str, nupnp_url: str, ip_file: str, request_timeout: int, delay: int, check_delay: int, check_fail_safe: int):
+    def __init__(self, id: str, api_key: str, nupnp_url: str, ip_file: str, request_timeout: int, delay: int, check_delay: int, breaker_threshold: int = 3, breaker_reset: int = 30, read_batch_window: float = 0, api_version: str = "v1"):
         self.__id = id.upper()
         self.__api_key = api_key
         self.__nupnp_url = nupnp_url
@@ -166,9 +168,17 @@ class HueBridge:
         self.__request_timeout = request_timeout
         self.__delay = delay
         self.__check_delay = check_delay
-        self.__check_fail_safe = check_fail_safe
+        self.__last_success = 0
+        self.__read_batch_window = read_batch_window
+        self.__api_version = api_version
         self.__host = None
         self.__thread = threading.Thread(name="discovery-{}".format(id), target=self.__rediscover, daemon=True)
+        self.__check_event = threading.Event()
+        self.__breaker = CircuitBreaker(
+            name="bridge-{}".format(self.__id),
+            threshold=breaker_threshold,
+            reset_timeout=breaker_reset
+        )
 
     @property
     def host(self):
@@ -186,6 +196,18 @@ class HueBridge:
     def request_timeout(self):
         return self.__request_timeout
 
+    @property
+    def api_version(self) -> str:
+        return self.__api_version
+
+    @property
+    def read_batch_window(self) -> float:
+        return self.__read_batch_window
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self.__breaker
+
     def start_discovery(self):
         while not self.__host:
             self.__host = self.__discover()
@@ -210,24 +232,44 @@ class HueBridge:
             logger.error("discovery of '{}' failed - {}".format(self.__id, ex))
         return None
 
+    def success(self):
+        # called for every request that reached the bridge, recent traffic makes active checks unnecessary
+        self.__last_success = time.monotonic()
+        self.__breaker.success()
+
+    def failure(self, reachable: bool = True):
+        self.__breaker.failure()
+        if not reachable:
+            self.__check_event.set()
+
+    @property
+    def last_success(self) -> float:
+        return self.__last_success
+
     def __rediscover(self):
-        fail_safe = 0
+        lost = False
         while True:
-            delay = self.__check_delay
-            if not validate_host(self.__host, self.__id, self.__request_timeout):
-                if fail_safe > self.__check_fail_safe:
-                    logger.warning("location of '{}' seems to have changed or is not reachable".format(self.__id))
-                    host = self.__discover()
-                    if host:
-                        fail_safe = 0
-                        self.__host = host
-                        logger.info("discovered '{}' at '{}'".format(self.__id, self.__host))
-                    else:
-                        delay = self.__delay
-                else:
-                    fail_safe += 1
+            if lost:
+                time.sleep(self.__delay)
+                triggered = False
             else:
-                if fail_safe > 0:
+                triggered = self.__check_event.wait(self.__check_delay)
+            self.__check_event.clear()
+            if not (triggered or lost) and time.monotonic() - self.__last_success < self.__check_delay:
+                continue
+            if not lost and validate_host(self.__host, self.__id, self.__request_timeout):
+                if triggered:
                     logger.info("location of '{}' is unchanged and reachable".format(self.__id))
-                fail_safe = 0
-            time.sleep(delay)
+                # the bridge may still fail api requests, an open circuit is left to its half-open probe
+                self.__last_success = time.monotonic()
+                continue
+            logger.warning("location of '{}' seems to have changed or is not reachable".format(self.__id))
+            host = self.__discover()
+            if host:
+                lost = False
+                self.__host = host
+                self.success()
+                logger.info("discovered '{}' at '{}'".format(self.__id, self.__host))
+            else:
+                lost = True
+                self.__breaker.failure()
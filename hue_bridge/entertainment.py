@@ -0,0 +1,268 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+__all__ = ("EntertainmentStreamer", "UDPTransport", "DTLSTransport", "transport_map", "gen_stream_topic")
+
+
+from util import get_logger
+from .discovery import HueBridge
+from .backend import put
+import threading
+import socket
+import typing
+import struct
+import json
+import time
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+def gen_stream_topic(dc_id: str) -> str:
+    return "entertainment/{}".format(dc_id)
+
+
+def gen_frame(sequence: int, colors: typing.Dict[int, typing.Sequence[int]]) -> bytes:
+    # HueStream v1, RGB color space, 16 bit per channel
+    frame = bytearray(b"HueStream")
+    frame += bytes((0x01, 0x00, sequence & 0xFF, 0x00, 0x00, 0x00, 0x00))
+    for light, (red, green, blue) in colors.items():
+        frame += struct.pack(">BHHHH", 0x00, light, red * 257, green * 257, blue * 257)
+    return bytes(frame)
+
+
+class UDPTransport:
+    def __init__(self, host: str, port: int, **kwargs):
+        self.__address = (host, port)
+        self.__socket = None
+
+    def open(self):
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__socket.connect(self.__address)
+
+    def send(self, frame: bytes):
+        self.__socket.send(frame)
+
+    def close(self):
+        if self.__socket:
+            self.__socket.close()
+            self.__socket = None
+
+
+class DTLSTransport:
+    def __init__(self, host: str, port: int, identity: str, client_key: str, timeout: float = 5):
+        self.__address = (host, port)
+        self.__identity = identity
+        self.__client_key = client_key
+        self.__timeout = timeout
+        self.__socket = None
+
+    def open(self):
+        # optional dependency, only needed if streaming via dtls is enabled
+        from mbedtls import tls
+        conf = tls.DTLSConfiguration(
+            pre_shared_key=(self.__identity, bytes.fromhex(self.__client_key)),
+            ciphers=("TLS-PSK-WITH-AES-128-GCM-SHA256", ),
+            lowest_supported_version=tls.DTLSVersion.DTLSv1_2,
+            highest_supported_version=tls.DTLSVersion.DTLSv1_2,
+            validate_certificates=False
+        )
+        sock = tls.ClientContext(conf).wrap_socket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), server_hostname=None)
+        sock.settimeout(self.__timeout)
+        sock.connect(self.__address)
+        deadline = time.monotonic() + self.__timeout
+        while True:
+            try:
+                sock.do_handshake()
+                break
+            except (tls.WantReadError, tls.WantWriteError):
+                if time.monotonic() > deadline:
+                    sock.close()
+                    raise TimeoutError("dtls handshake timed out")
+        self.__socket = sock
+
+    def send(self, frame: bytes):
+        self.__socket.send(frame)
+
+    def close(self):
+        if self.__socket:
+            try:
+                self.__socket.close()
+            finally:
+                self.__socket = None
+
+
+transport_map = {
+    "udp": UDPTransport,
+    "dtls": DTLSTransport
+}
+
+
+class EntertainmentStreamer(threading.Thread):
+    """
+    Sends the latest colors of an entertainment group at a fixed rate. Frames that arrive faster than the rate are
+    merged, frames older than max_frame_age when due are dropped. Streaming is activated on the first frame and
+    deactivated after idle_timeout seconds without frames.
+    """
+
+    def __init__(self, hue_bridge: HueBridge, group: str, transport: str, client_key: str, port: int, rate: int, max_frame_age: float, idle_timeout: float, keep_alive: float = 1):
+        super().__init__(name="entertainment-{}".format(hue_bridge.id), daemon=True)
+        self.__hue_bridge = hue_bridge
+        self.__group = group
+        self.__transport_cls = transport_map[transport]
+        self.__client_key = client_key
+        self.__port = port
+        self.__interval = 1 / rate
+        self.__max_frame_age = max_frame_age
+        self.__idle_timeout = idle_timeout
+        self.__keep_alive = keep_alive
+        self.__transport = None
+        self.__colors = dict()
+        self.__frame_time = 0
+        self.__pending = False
+        self.__sequence = 0
+        self.__lock = threading.Lock()
+        self.__event = threading.Event()
+        self.__sent = 0
+        self.__dropped = 0
+        self.__merged = 0
+
+    def run(self):
+        logger.info("starting '{}' ...".format(self.name))
+        last_sent = 0
+        next_tick = time.monotonic()
+        while True:
+            try:
+                if not self.__transport:
+                    self.__event.clear()
+                    if not self.__pending:
+                        self.__event.wait()
+                    self.__activate()
+                    next_tick = time.monotonic()
+                with self.__lock:
+                    pending = self.__pending
+                    frame_time = self.__frame_time
+                    self.__pending = False
+                    colors = dict(self.__colors)
+                now = time.monotonic()
+                if pending:
+                    if now - frame_time > self.__max_frame_age:
+                        self.__dropped += 1
+                    else:
+                        self.__send(colors)
+                        last_sent = now
+                elif now - frame_time > self.__idle_timeout:
+                    self.__deactivate()
+                    continue
+                elif colors and now - last_sent > self.__keep_alive:
+                    self.__send(colors)
+                    last_sent = now
+                next_tick += self.__interval
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_tick = time.monotonic()
+            except Exception as ex:
+                logger.error("streaming to '{}' failed - {}".format(self.__group, ex))
+                with self.__lock:
+                    self.__pending = False
+                self.__deactivate()
+                time.sleep(1)
+
+    def __activate(self):
+        err, body = put(
+            bridge=self.__hue_bridge,
+            path=f"groups/{self.__group}",
+            payload={"stream": {"active": True}}
+        )
+        if err:
+            raise RuntimeError("could not activate streaming - {}".format(body))
+        transport = self.__transport_cls(
+            host=self.__hue_bridge.host,
+            port=self.__port,
+            identity=self.__hue_bridge.api_key,
+            client_key=self.__client_key
+        )
+        try:
+            transport.open()
+        except Exception:
+            # __deactivate only resets the group once a transport is open
+            err, body = put(
+                bridge=self.__hue_bridge,
+                path=f"groups/{self.__group}",
+                payload={"stream": {"active": False}}
+            )
+            if err:
+                logger.warning("could not deactivate streaming - {}".format(body))
+            raise
+        self.__transport = transport
+        logger.info("streaming to '{}' active".format(self.__group))
+
+    def __deactivate(self):
+        if self.__transport:
+            self.__transport.close()
+            self.__transport = None
+            err, body = put(
+                bridge=self.__hue_bridge,
+                path=f"groups/{self.__group}",
+                payload={"stream": {"active": False}}
+            )
+            if err:
+                logger.warning("could not deactivate streaming - {}".format(body))
+            logger.info("streaming to '{}' inactive - {}".format(self.__group, self.stats))
+
+    def __send(self, colors: dict):
+        self.__transport.send(gen_frame(self.__sequence, colors))
+        self.__sequence += 1
+        self.__sent += 1
+
+    def put_frame(self, colors: typing.Dict[int, typing.Sequence[int]], timestamp: typing.Optional[float] = None):
+        # timestamp is the wall clock time the frame was created at
+        frame_time = time.monotonic()
+        if timestamp is not None:
+            frame_time -= max(time.time() - timestamp, 0)
+        with self.__lock:
+            if frame_time < self.__frame_time:
+                self.__dropped += 1
+                return
+            if self.__pending:
+                self.__merged += 1
+            self.__colors.update(colors)
+            self.__frame_time = frame_time
+            self.__pending = True
+        self.__event.set()
+
+    def handle_message(self, payload: typing.AnyStr):
+        msg = json.loads(payload)
+        colors = dict()
+        for light, color in msg["lights"].items():
+            light = int(light)
+            color = tuple(int(value) for value in color)
+            # rejected here, a bad value in a frame would fail every following frame in the streaming thread
+            if not 0 <= light <= 0xFFFF or len(color) != 3 or not all(0 <= value <= 255 for value in color):
+                raise ValueError("invalid color '{}' for light '{}'".format(color, light))
+            colors[light] = color
+        self.put_frame(colors=colors, timestamp=msg.get("time"))
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "sent": self.__sent,
+            "dropped": self.__dropped,
+            "merged": self.__merged
+        }
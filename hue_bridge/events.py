@@ -0,0 +1,105 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+__all__ = ("EventPipeline", )
+
+
+from util import get_logger, MQTTClient, msg_class
+from .device import Device
+from .service import service_map
+import threading
+import typing
+import time
+import json
+import mgw_dc
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class EventPipeline:
+    """
+    Publishes device events. Events whose value and lastupdated equal the last published event are dropped.
+    After an event was published, further events of the same device and service are held back for debounce
+    seconds and only the latest one is published. With batch enabled events are only published on flush.
+    """
+
+    def __init__(self, mqtt_client: MQTTClient, debounce: float = 0, batch: bool = False):
+        self.__mqtt_client = mqtt_client
+        self.__debounce = debounce
+        self.__batch = batch
+        self.__last = dict()
+        self.__pending = dict()
+        self.__lock = threading.Lock()
+        self.__emitted = 0
+        self.__suppressed = 0
+
+    def put(self, device: Device, srv_id: str, value, lastupdated: typing.Optional[str] = None):
+        key = (device.id, srv_id)
+        now = time.monotonic()
+        with self.__lock:
+            last = self.__last.get(key)
+            if last and last[1] == value and last[2] == lastupdated:
+                if self.__pending.pop(key, None):
+                    self.__suppressed += 1
+                self.__suppressed += 1
+                return
+            if key in self.__pending:
+                self.__suppressed += 1
+            self.__pending[key] = (device, value, lastupdated, max(now, last[0] + self.__debounce) if last else now)
+        if not self.__batch:
+            self.flush()
+
+    def flush(self):
+        now = time.monotonic()
+        with self.__lock:
+            due = [(key, item) for key, item in self.__pending.items() if item[3] <= now]
+            for key, (device, value, lastupdated, _) in due:
+                del self.__pending[key]
+                self.__last[key] = (now, value, lastupdated)
+        for (device_id, srv_id), (device, _, _, _) in due:
+            try:
+                self.__mqtt_client.publish(
+                    topic=mgw_dc.com.gen_event_topic(device_id, srv_id),
+                    payload=json.dumps(service_map[srv_id](device)),
+                    msg_cls=msg_class.event
+                )
+                self.__emitted += 1
+            except Exception as ex:
+                logger.error("can't send event for '%s' - %s", device_id, ex)
+
+    def next_flush(self) -> typing.Optional[float]:
+        with self.__lock:
+            if not self.__pending:
+                return None
+            return max(min(item[3] for item in self.__pending.values()) - time.monotonic(), 0)
+
+    def forget(self, device_id: str):
+        with self.__lock:
+            for key in [key for key in self.__last if key[0] == device_id]:
+                del self.__last[key]
+            for key in [key for key in self.__pending if key[0] == device_id]:
+                del self.__pending[key]
+
+    @property
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                "emitted": self.__emitted,
+                "suppressed": self.__suppressed,
+                "pending": len(self.__pending)
+            }
@@ -0,0 +1,131 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+__all__ = ("History", "HistoryStore")
+
+
+import threading
+import typing
+import array
+
+
+# keys like "state.on" are stored as indexes into this table, shared by all histories
+_keys = list()
+_key_index = dict()
+_key_lock = threading.Lock()
+
+
+def _intern_key(key: str) -> int:
+    index = _key_index.get(key)
+    if index is None:
+        with _key_lock:
+            index = _key_index.get(key)
+            if index is None:
+                index = len(_keys)
+                _keys.append(key)
+                _key_index[key] = index
+    return index
+
+
+class History:
+    """
+    Fixed size ring buffer of timestamped state changes. Timestamps and keys are kept in arrays, once full the
+    oldest entry is overwritten.
+    """
+
+    __slots__ = ("__times", "__keys", "__values", "__size", "__next", "__count", "__lock")
+
+    def __init__(self, size: int):
+        self.__times = array.array("d", bytes(8 * size))
+        self.__keys = array.array("I", bytes(4 * size))
+        self.__values = [None] * size
+        self.__size = size
+        self.__next = 0
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    def record(self, timestamp: float, key: str, value) -> None:
+        with self.__lock:
+            pos = self.__next
+            self.__times[pos] = timestamp
+            self.__keys[pos] = _intern_key(key)
+            self.__values[pos] = value
+            self.__next = (pos + 1) % self.__size
+            if self.__count < self.__size:
+                self.__count += 1
+
+    def query(self, since: typing.Optional[float] = None, key: typing.Optional[str] = None, limit: typing.Optional[int] = None) -> typing.List[typing.Tuple[float, str, typing.Any]]:
+        """Entries oldest first, limit keeps the newest ones."""
+        with self.__lock:
+            start = (self.__next - self.__count) % self.__size
+            positions = [(start + num) % self.__size for num in range(self.__count)]
+            entries = [(self.__times[pos], _keys[self.__keys[pos]], self.__values[pos]) for pos in positions]
+        if since is not None:
+            entries = [entry for entry in entries if entry[0] >= since]
+        if key is not None:
+            entries = [entry for entry in entries if entry[1] == key]
+        if limit is not None:
+            entries = entries[-limit:] if limit > 0 else []
+        return entries
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def __len__(self):
+        return self.__count
+
+
+class HistoryStore:
+    """
+    Hands out histories of up to size entries per device while keeping the total number of entries at or below
+    total_size. Devices added after the budget is used up get no history.
+    """
+
+    def __init__(self, size: int, total_size: int):
+        self.__size = size
+        self.__total_size = total_size
+        self.__histories = dict()
+        self.__allocated = 0
+        self.__lock = threading.Lock()
+
+    def allocate(self, device_id: str) -> typing.Optional[History]:
+        with self.__lock:
+            if device_id in self.__histories:
+                return self.__histories[device_id]
+            size = min(self.__size, self.__total_size - self.__allocated)
+            if size <= 0:
+                return None
+            history = History(size)
+            self.__histories[device_id] = history
+            self.__allocated += size
+            return history
+
+    def forget(self, device_id: str) -> None:
+        with self.__lock:
+            history = self.__histories.pop(device_id, None)
+            if history is not None:
+                self.__allocated -= history.size
+
+    @property
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                "devices": len(self.__histories),
+                "allocated": self.__allocated,
+                "entries": sum(len(history) for history in self.__histories.values())
+            }
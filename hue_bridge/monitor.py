@@ -18,14 +18,19 @@
 __all__ = ("Monitor", )
 
 
-from util import get_logger, MQTTClient
+from util import get_logger, MQTTClient, msg_class, timers
 from .device import Device
 from .discovery import HueBridge
-from .service import event_service_map, service_map
+from .parser import RawPollParser, parse_device
+from .events import EventPipeline
+from .history import HistoryStore
+from .service import event_service_map
 import threading
+import random
 import time
 import requests
 import typing
+import hashlib
 import json
 import mgw_dc
 
@@ -34,7 +39,7 @@ logger = get_logger(__name__.split(".", 1)[-1])
 
 
 class Monitor(threading.Thread):
-    def __init__(self, hue_bridge: HueBridge, mqtt_client: MQTTClient, device_pool: typing.Dict[str, Device], type_map: typing.Dict, query_delay: int, request_timeout: int, device_id_prefix: str, dc_id: str):
+    def __init__(self, hue_bridge: HueBridge, mqtt_client: MQTTClient, device_pool: typing.Dict[str, Device], type_map: typing.Dict, query_delay: int, request_timeout: int, device_id_prefix: str, dc_id: str, raw_parser: bool = False, event_debounce: float = 0, event_batch: bool = False, stats_interval: int = 300, refresh_batch_size: int = 50, refresh_batch_delay: float = 0.1, refresh_jitter: float = 5, wildcard_commands: bool = False, history_size: int = 100, history_total_size: int = 100000, refresh_full: bool = False, recorder=None):
         super().__init__(name="monitor-{}".format(hue_bridge.id), daemon=True)
         self.__hue_bridge = hue_bridge
         self.__mqtt_client = mqtt_client
@@ -45,74 +50,139 @@ class Monitor(threading.Thread):
         self.__device_id_prefix = device_id_prefix
         self.__dc_id = dc_id
         self.__refresh_flag = 0
+        self.__refresh_full = False
+        self.__always_full = refresh_full
+        self.__announced = dict()
+        self.__recorder = recorder
         self.__lock = threading.Lock()
         self.__unsupported_types = set()
+        self.__raw_parser = RawPollParser(self.__parse_device) if raw_parser else None
+        self.__stale = set()
+        self.__confirm = set()
+        self.__wake = threading.Event()
+        self.__poll_now = False
+        self.__events = EventPipeline(mqtt_client=mqtt_client, debounce=event_debounce, batch=event_batch)
+        self.__stats_interval = stats_interval
+        self.__refresh_batch_size = refresh_batch_size
+        self.__refresh_batch_delay = refresh_batch_delay
+        self.__refresh_jitter = refresh_jitter
+        self.__wildcard_commands = wildcard_commands
+        self.__history = HistoryStore(size=history_size, total_size=history_total_size) if history_size > 0 else None
 
     def run(self):
         if not self.__mqtt_client.connected():
             time.sleep(3)
-        logger.info("starting '{}' ...".format(self.name))
+        logger.info("starting '%s' ...", self.name)
+        stats_time = time.time()
         while True:
             if self.__refresh_flag:
                 self.__refresh_devices(self.__refresh_flag)
-            queried_devices = self.__queryBridge(("lights", "sensors"))
+            with timers.measure("monitor.query"):
+                queried_devices, changed, complete = self.__queryBridge(("lights", "sensors"))
             if queried_devices:
-                self.__evaluate(queried_devices)
-            time.sleep(self.__query_delay)
+                with timers.measure("monitor.evaluate"):
+                    self.__evaluate(queried_devices, changed, complete)
+            if self.__stats_interval and time.time() - stats_time > self.__stats_interval:
+                logger.info("events: %s", self.__events.stats)
+                if self.__history:
+                    logger.info("history: %s", self.__history.stats)
+                stats_time = time.time()
+            self.__wait(self.__query_delay)
+
+    def __wait(self, delay: float):
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            next_flush = self.__events.next_flush()
+            if not self.__wake.wait(remaining if next_flush is None else min(remaining, next_flush)):
+                self.__events.flush()
+                continue
+            self.__wake.clear()
+            if self.__poll_now:
+                self.__poll_now = False
+                with self.__lock:
+                    self.__confirm = set()
+                break
+            self.__confirm_devices()
+            self.__events.flush()
+
+    def __request(self, path: str):
+        try:
+            resp = requests.get(
+                f"https://{self.__hue_bridge.host}/api/{self.__hue_bridge.api_key}/{path}",
+                verify=False,
+                timeout=self.__request_timeout
+            )
+        except Exception:
+            self.__hue_bridge.failure(reachable=False)
+            raise
+        if resp.status_code >= 500:
+            self.__hue_bridge.failure()
+        else:
+            self.__hue_bridge.success()
+        return resp
 
     def __queryBridge(self, apis):
         devices = dict()
+        changed = set() if self.__raw_parser else None
+        complete = True
         for api in apis:
+            if not self.__hue_bridge.breaker.allow():
+                logger.debug("skipping query of '%s' - circuit open", api)
+                complete = False
+                continue
             try:
-                resp = requests.get(
-                    f"https://{self.__hue_bridge.host}/api/{self.__hue_bridge.api_key}/{api}",
-                    verify=False,
-                    timeout=self.__request_timeout
-                )
+                resp = self.__request(api)
                 if resp.ok:
-                    resp = resp.json()
-                    for number, device in resp.items():
-                        try:
-                            if device.get("type") in self.__type_map:
-                                devices["{}{}".format(self.__device_id_prefix, device["uniqueid"])] = {
-                                    "meta_data": {
-                                        "name": device["name"],
-                                        "model_id": device["modelid"],
-                                        "type": device["type"],
-                                        "manufacturer_name": device["manufacturername"],
-                                        "sw_version": device["swversion"],
-                                        "number": number,
-                                        # "api": api
-                                    },
-                                    "data": {
-                                        "state": device.get("state") or {},
-                                        "config": device.get("config") or {}
-                                    }
-                                }
-                            else:
-                                if device.get("type") not in self.__unsupported_types:
-                                    logger.warning("device type '{}' not supported".format(device.get("type")))
-                                    self.__unsupported_types.add(device.get("type"))
-                        except KeyError as ex:
-                            logger.error("could not parse device - {}\n{}".format(ex, device))
+                    if self.__recorder:
+                        self.__recorder.record_poll(api, resp.content)
+                    if self.__raw_parser:
+                        for item, item_changed in self.__raw_parser.parse(api, resp.content):
+                            if item:
+                                devices[item[0]] = item[1]
+                                if item_changed:
+                                    changed.add(item[0])
+                    else:
+                        for number, device in resp.json().items():
+                            item = self.__parse_device(number, device)
+                            if item:
+                                devices[item[0]] = item[1]
                 else:
                     raise RuntimeError(resp.status_code)
             except Exception as ex:
-                logger.error("could not query bridge - '{}'".format(ex))
-        return devices
+                complete = False
+                logger.error("could not query bridge - '%s'", ex)
+        return devices, changed, complete
+
+    def __parse_device(self, number: str, device: dict):
+        try:
+            item = parse_device(number, device, self.__type_map, self.__device_id_prefix)
+            if not item and device.get("type") not in self.__unsupported_types:
+                logger.warning("device type '%s' not supported", device.get("type"))
+                self.__unsupported_types.add(device.get("type"))
+            return item
+        except KeyError as ex:
+            logger.error("could not parse device - %s\n%s", ex, device)
 
     def __handle_missing_device(self, device_id: str):
         try:
             device = self.__device_pool[device_id]
-            logger.info("can't find '{}' with id '{}'".format(device.name, device.id))
+            logger.info("can't find '%s' with id '%s'", device.name, device.id)
             self.__update_dm(mgw_dc.dm.gen_delete_device_msg(device))
-            try:
-                self.__mqtt_client.unsubscribe(topic=mgw_dc.com.gen_command_topic(device.id))
-            except Exception as ex:
-                logger.warning("can't unsubscribe '{}' - {}".format(device.id, ex))
+            self.__announced.pop(device.id, None)
+            if not self.__wildcard_commands:
+                try:
+                    self.__mqtt_client.unsubscribe(topic=mgw_dc.com.gen_command_topic(device.id))
+                except Exception as ex:
+                    logger.warning("can't unsubscribe '%s' - %s", device.id, ex)
             del self.__device_pool[device.id]
+            self.__events.forget(device.id)
+            if self.__history:
+                self.__history.forget(device.id)
         except Exception as ex:
-            logger.error("can't remove '{}' - {}".format(device_id, ex))
+            logger.error("can't remove '%s' - %s", device_id, ex)
 
     def __handle_new_device(self, device_id: str, data: dict):
         try:
@@ -122,68 +192,132 @@ class Monitor(threading.Thread):
                 bridge=self.__hue_bridge,
                 **data
             )
-            logger.info("found '{}' with id '{}'".format(device.name, device_id))
-            self.__update_dm(mgw_dc.dm.gen_set_device_msg(device))
-            self.__mqtt_client.subscribe(topic=mgw_dc.com.gen_command_topic(device_id), qos=1)
+            logger.info("found '%s' with id '%s'", device.name, device_id)
+            self.__announce(device)
+            if not self.__wildcard_commands:
+                self.__mqtt_client.subscribe(topic=mgw_dc.com.gen_command_topic(device_id), qos=1)
+            device.on_state_applied = self.__on_state_applied
+            if self.__history:
+                device.history = self.__history.allocate(device.id)
             self.__device_pool[device.id] = device
         except Exception as ex:
-            logger.error("can't add '{}' - {}".format(device_id, ex))
+            logger.error("can't add '%s' - %s", device_id, ex)
 
     def __handle_changed_meta_data(self, device_id: str, data: dict):
         try:
             device = self.__device_pool[device_id]
-            meta_data_bk = device.data.copy()
+            meta_data_bk = device.meta_data.copy()
             try:
                 device.meta_data = data
-                self.__update_dm(mgw_dc.dm.gen_set_device_msg(device))
+                self.__announce(device)
             except Exception as ex:
                 device.meta_data = meta_data_bk
                 raise ex
         except Exception as ex:
-            logger.error("can't update '{}' - {}".format(device_id, ex))
+            self.__stale.add(device_id)
+            logger.error("can't update '%s' - %s", device_id, ex)
 
     def __handle_changed_data(self, device_id: str, data: dict):
         try:
             device = self.__device_pool[device_id]
+            if device.in_transition and "state" in data:
+                # only fading keys keep their target, the device is checked again until the transition is over
+                data = {**data, "state": device.mask_transition(data["state"])}
+                self.__stale.add(device_id)
             data_bk = device.data.copy()
             state_bk = device.state
             try:
-                device.data = data
+                changed = device.update_data(data)
                 if state_bk != device.state:
-                    self.__update_dm(mgw_dc.dm.gen_set_device_msg(device))
-                try:
-                    for data_key in device.data:
-                        for key in set(event_service_map.keys()).intersection(device.data[data_key]):
-                            if data_bk[data_key][key] != device.data[data_key][key]:
-                                try:
-                                    self.__mqtt_client.publish(
-                                        topic=mgw_dc.com.gen_event_topic(device.id, event_service_map[key]),
-                                        payload=json.dumps(service_map[event_service_map[key]](device)),
-                                        qos=1
-                                    )
-                                except Exception as ex:
-                                    logger.error(f"can't send event for '{device.id}' - {ex}")
-                except Exception as ex:
-                    logger.error(f"error handling events for '{device.id}' - {ex}")
+                    self.__announce(device)
+                self.__record_history(device, changed)
+                self.__publish_events(device, changed)
             except Exception as ex:
                 device.data = data_bk
                 raise ex
         except Exception as ex:
-            logger.error("can't update '{}' - {}".format(device_id, ex))
+            self.__stale.add(device_id)
+            logger.error("can't update '%s' - %s", device_id, ex)
+
+    def __record_history(self, device: Device, changed: typing.Dict[str, typing.List[str]]):
+        if device.history is None:
+            return
+        timestamp = time.time()
+        for data_key, keys in changed.items():
+            section = device.data[data_key]
+            for key in keys:
+                if key in section:
+                    device.history.record(timestamp, "{}.{}".format(data_key, key), section[key])
+
+    def __publish_events(self, device: Device, changed: typing.Dict[str, typing.List[str]]):
+        try:
+            for data_key, keys in changed.items():
+                section = device.data[data_key]
+                keys = set(keys)
+                if "lastupdated" in keys:
+                    # repeated values with a new timestamp are new events, e.g. pressing the same button twice
+                    keys.update(section)
+                for key in event_service_map.keys() & keys:
+                    if key in section:
+                        self.__events.put(device, event_service_map[key], section[key], section.get("lastupdated"))
+        except Exception as ex:
+            logger.error("error handling events for '%s' - %s", device.id, ex)
+
+    def __on_state_applied(self, device: Device, changed: typing.Optional[typing.List[str]]):
+        if changed is None:
+            self.__poll_now = True
+        else:
+            self.__record_history(device, {"state": changed})
+            self.__publish_events(device, {"state": changed})
+            with self.__lock:
+                # the bridge may report success without changing the state, e.g. for unreachable lights, the
+                # confirmation masks faded keys and the next poll diffs the device even if its response is unchanged
+                self.__confirm.add(device.id)
+                self.__stale.add(device.id)
+        self.__wake.set()
+
+    def __confirm_devices(self):
+        with self.__lock:
+            device_ids = self.__confirm
+            self.__confirm = set()
+        for device_id in device_ids:
+            try:
+                device = self.__device_pool[device_id]
+                if not self.__hue_bridge.breaker.allow():
+                    break
+                resp = self.__request(f"lights/{device.number}")
+                if not resp.ok:
+                    raise RuntimeError(resp.status_code)
+                item = self.__parse_device(device.number, resp.json())
+                if item and item[0] == device_id:
+                    if device.meta_data != item[1]["meta_data"]:
+                        self.__handle_changed_meta_data(device_id, item[1]["meta_data"])
+                    if device.data != item[1]["data"]:
+                        self.__handle_changed_data(device_id, item[1]["data"])
+            except KeyError:
+                pass
+            except Exception as ex:
+                logger.warning("could not confirm state of '%s' - %s", device_id, ex)
 
-    def __diff(self, known: dict, unknown: dict):
+    def __diff(self, known: dict, unknown: dict, changed: typing.Optional[set] = None):
         known_set = set(known)
         unknown_set = set(unknown)
         missing = known_set - unknown_set
         new = unknown_set - known_set
-        changed_meta_data = {key for key in known_set & unknown_set if known[key].meta_data != unknown[key]["meta_data"]}
-        changed_data = {key for key in known_set & unknown_set if known[key].data != unknown[key]["data"]}
+        candidates = known_set & unknown_set if changed is None else known_set & unknown_set & changed
+        changed_meta_data = {key for key in candidates if known[key].meta_data != unknown[key]["meta_data"]}
+        changed_data = {key for key in candidates if known[key].data != unknown[key]["data"]}
         return missing, new, changed_meta_data, changed_data
 
-    def __evaluate(self, queried_devices):
+    def __evaluate(self, queried_devices, changed=None, complete=True):
         try:
-            missing_devices, new_devices, changed_meta_data, changed_data = self.__diff(self.__device_pool, queried_devices)
-            if missing_devices:
+            if changed is not None and self.__stale:
+                with self.__lock:
+                    stale, self.__stale = self.__stale, set()
+                changed |= stale
+            missing_devices, new_devices, changed_meta_data, changed_data = self.__diff(self.__device_pool, queried_devices, changed)
+            if missing_devices and complete:
+                # devices of an api that was skipped or failed are not missing
                 for device_id in missing_devices:
                     self.__handle_missing_device(device_id)
             if new_devices:
@@ -196,30 +330,75 @@ class Monitor(threading.Thread):
                 for device_id in changed_data:
                     self.__handle_changed_data(device_id, queried_devices[device_id]["data"])
         except Exception as ex:
-            logger.error("can't evaluate devices - {}".format(ex))
+            logger.error("can't evaluate devices - %s", ex)
+        self.__events.flush()
 
     def __refresh_devices(self, flag: int):
         with self.__lock:
             if self.__refresh_flag == flag:
                 self.__refresh_flag = 0
-        for device in self.__device_pool.values():
+            full = self.__refresh_full or self.__always_full
+            self.__refresh_full = False
+        if self.__refresh_jitter:
+            time.sleep(random.uniform(0, self.__refresh_jitter))
+        devices = list(self.__device_pool.values())
+        count = 0
+        announced = 0
+        for device in devices:
+            busy = False
             try:
-                self.__update_dm(mgw_dc.dm.gen_set_device_msg(device))
+                if self.__announce(device, force=full):
+                    announced += 1
+                    busy = True
             except Exception as ex:
-                logger.error("setting device '{}' failed - {}".format(device.id, ex))
-            if flag > 1:
+                logger.error("setting device '%s' failed - %s", device.id, ex)
+            if flag > 1 and not self.__wildcard_commands:
+                busy = True
                 try:
                     self.__mqtt_client.subscribe(topic=mgw_dc.com.gen_command_topic(device.id), qos=1)
                 except Exception as ex:
-                    logger.error("subscribing device '{}' failed - {}".format(device.id, ex))
+                    logger.error("subscribing device '%s' failed - %s", device.id, ex)
+            if busy:
+                count += 1
+                if self.__refresh_batch_size and count % self.__refresh_batch_size == 0:
+                    time.sleep(self.__refresh_batch_delay)
+        logger.info("refresh announced %s of %s devices%s", announced, len(devices), " (full)" if full else "")
+
+    def __announce(self, device: Device, force: bool = True) -> bool:
+        # devices are only announced again if their message differs from the last one published
+        payload = json.dumps(mgw_dc.dm.gen_set_device_msg(device))
+        digest = hashlib.blake2b(payload.encode(), digest_size=16).digest()
+        if not force and self.__announced.get(device.id) == digest:
+            return False
+        self.__mqtt_client.publish(
+            topic=mgw_dc.dm.gen_device_topic(self.__dc_id),
+            payload=payload,
+            msg_cls=msg_class.device_manager
+        )
+        self.__announced[device.id] = digest
+        return True
 
     def __update_dm(self, msg: dict):
         self.__mqtt_client.publish(
             topic=mgw_dc.dm.gen_device_topic(self.__dc_id),
             payload=json.dumps(msg),
-            qos=1
+            msg_cls=msg_class.device_manager
         )
 
-    def schedule_refresh(self, subscribe: bool = False):
+    @property
+    def event_stats(self) -> dict:
+        return self.__events.stats
+
+    @property
+    def history_stats(self) -> typing.Optional[dict]:
+        return self.__history.stats if self.__history else None
+
+    def forget_announced(self):
+        # announces may have been dropped from the offline buffer, the next refresh sends all devices
+        self.__announced.clear()
+
+    def schedule_refresh(self, subscribe: bool = False, full: bool = False):
         with self.__lock:
             self.__refresh_flag = max(self.__refresh_flag, int(subscribe) + 1)
+            # without a session present the broker may have lost announces that were still in flight
+            self.__refresh_full = self.__refresh_full or full or subscribe
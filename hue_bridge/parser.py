@@ -0,0 +1,102 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+__all__ = ("RawPollParser", "parse_device")
+
+
+import typing
+import json
+import re
+
+
+def parse_device(number: str, device: dict, type_map: typing.Dict, device_id_prefix: str) -> typing.Optional[typing.Tuple[str, dict]]:
+    if device.get("type") not in type_map:
+        return None
+    return "{}{}".format(device_id_prefix, device["uniqueid"]), {
+        "meta_data": {
+            "name": device["name"],
+            "model_id": device["modelid"],
+            "type": device["type"],
+            "manufacturer_name": device["manufacturername"],
+            "sw_version": device["swversion"],
+            "number": number,
+            # "api": api
+        },
+        "data": {
+            "state": device.get("state") or {},
+            "config": device.get("config") or {}
+        }
+    }
+
+
+# each match skips strings and other characters up to the next bracket
+_bracket = re.compile(rb'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*([{}\[\]])')
+_whitespace = b" \t\r\n"
+_open = (ord("{"), ord("["))
+
+
+class RawPollParser:
+    """
+    Splits a bridge collection response (e.g. /lights) into the raw bytes of each member without decoding the
+    whole document. Members are only decoded and passed to parse_item if their bytes differ from the previous
+    response, otherwise the cached result is returned again.
+    """
+
+    def __init__(self, parse_item: typing.Callable[[str, dict], typing.Any]):
+        self.__parse_item = parse_item
+        self.__cache = dict()
+
+    def parse(self, api: str, raw: bytes) -> typing.Generator[typing.Tuple[typing.Any, bool], None, None]:
+        cache = self.__cache.get(api) or dict()
+        new_cache = dict()
+        try:
+            with memoryview(raw) as view:
+                for key, start, end in self.__split(raw):
+                    cached = cache.get(key)
+                    if cached is not None and view[start:end] == cached[0]:
+                        new_cache[key] = cached
+                        yield cached[1], False
+                    else:
+                        item = self.__parse_item(key, json.loads(raw[start:end]))
+                        new_cache[key] = (raw[start:end], item)
+                        yield item, True
+        finally:
+            self.__cache[api] = new_cache
+
+    def reset(self):
+        self.__cache.clear()
+
+    @staticmethod
+    def __split(raw: bytes) -> typing.Generator[typing.Tuple[str, int, int], None, None]:
+        if raw.lstrip(_whitespace)[:1] != b"{":
+            raise ValueError("expected json object")
+        depth = 0
+        start = None
+        for match in _bracket.finditer(raw):
+            pos = match.start(1)
+            if raw[pos] in _open:
+                if depth == 1:
+                    start = pos
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1 and start is not None:
+                    key_end = raw.rindex(b'"', 0, start)
+                    yield raw[raw.rindex(b'"', 0, key_end) + 1:key_end].decode(), start, match.end()
+                    start = None
+        if depth != 0:
+            raise ValueError("incomplete json object")
@@ -0,0 +1,83 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+__all__ = ("BatchReader", )
+
+
+import threading
+import typing
+import time
+
+
+class _Batch:
+    __slots__ = ("done", "result", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.waiters = 0
+
+
+class BatchReader:
+    """
+    Collects single light reads arriving within window seconds and serves them with one fetch of the whole
+    light collection. The first reader of a batch waits for the window, fetches and wakes the others.
+    """
+
+    def __init__(self, fetch: typing.Callable[[], typing.Tuple[int, typing.Any]], window: float):
+        self.__fetch = fetch
+        self.__window = window
+        self.__batch = None
+        self.__lock = threading.Lock()
+        self.__reads = 0
+        self.__fetches = 0
+
+    def read(self, number: str) -> typing.Tuple[int, typing.Any]:
+        with self.__lock:
+            batch = self.__batch
+            leader = batch is None
+            if leader:
+                batch = self.__batch = _Batch()
+            batch.waiters += 1
+            self.__reads += 1
+        if leader:
+            time.sleep(self.__window)
+            with self.__lock:
+                self.__batch = None
+                self.__fetches += 1
+            try:
+                batch.result = self.__fetch()
+            except Exception as ex:
+                batch.result = 1, "could not read lights - {}".format(ex)
+            batch.done.set()
+        else:
+            batch.done.wait()
+        err, body = batch.result
+        if err:
+            return err, body
+        try:
+            return 0, body[number]
+        except KeyError:
+            return 1, "resource, /lights/{}, not available".format(number)
+
+    @property
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                "reads": self.__reads,
+                "fetches": self.__fetches
+            }
@@ -15,22 +15,26 @@
 """
 
 
-__all__ = ("service_map", "event_service_map")
+__all__ = ("service_map", "event_service_map", "set_services", "cache_services", "coalesce_services")
 
 
 from util import get_logger
 from .device import Device
-import rgbxy
+from .discovery import HueBridge
+from .reader import BatchReader
+from .backend import backend_map
 import datetime
-import requests
 
 
 logger = get_logger(__name__.split(".", 1)[-1])
 
 converter_pool = dict()
+reader_pool = dict()
+backend_pool = dict()
 
 
 def get_gamut(model_id):
+    import rgbxy
     # https://developers.meethue.com/develop/hue-api/supported-devices/
     if model_id in ("LCT001", "LCT007", "LCT002", "LCT003", "LLM001"):
         return rgbxy.GamutB
@@ -45,69 +49,59 @@ def get_gamut(model_id):
 
 def get_converter(model: str):
     if not model in converter_pool:
+        # color conversion is only needed by color services
+        import rgbxy
         converter = rgbxy.Converter(get_gamut(model))
         converter_pool[model] = converter
         return converter
     return converter_pool[model]
 
 
-def put(url: str, payload: dict, timeout: int):
-    try:
-        resp = requests.put(
-            url=url,
-            json=payload,
-            verify=False,
-            timeout=timeout
-        )
-        if resp.status_code == 200:
-            resp = resp.json()
-            if isinstance(resp, list):
-                if "success" in resp[0]:
-                    return 0, "ok"
-                if "error" in resp[0]:
-                    return 1, resp[0]["error"]["description"]
-            else:
-                return 1, "unknown error"
-        else:
-            return 1, resp.status_code
-    except Exception as ex:
-        return 1, "could not send request to hue bridge - {}".format(ex)
-
-
-def get(url: str, timeout: int):
-    try:
-        resp = requests.get(
-            url=url,
-            verify=False,
-            timeout=timeout
-        )
-        if resp.status_code == 200:
-            resp = resp.json()
-            if isinstance(resp, dict):
-                return 0, resp["state"]
-            elif isinstance(resp, list):
-                return 1, resp[0]["error"]["description"]
-            else:
-                return 1, "unknown error"
-        else:
-            return 1, resp.status_code
-    except Exception as ex:
-        return 1, "could not send request to hue bridge - {}".format(ex)
+def get_backend(bridge: HueBridge):
+    if bridge.id not in backend_pool:
+        backend_pool[bridge.id] = backend_map[bridge.api_version](bridge)
+    return backend_pool[bridge.id]
+
+
+def get_reader(bridge: HueBridge) -> BatchReader:
+    if bridge.id not in reader_pool:
+        reader_pool[bridge.id] = BatchReader(fetch=get_backend(bridge).get_lights, window=bridge.read_batch_window)
+    return reader_pool[bridge.id]
+
+
+def read_light_state(device: Device):
+    if device.bridge.read_batch_window > 0:
+        err, body = get_reader(device.bridge).read(device.number)
+    else:
+        err, body = get_backend(device.bridge).get_light(device.number)
+    if err:
+        return err, body
+    return 0, device.mask_transition(body["state"])
+
+
+def apply_success(device: Device, success: dict):
+    prefix = f"/lights/{device.number}/state/"
+    state = {key[len(prefix):]: value for key, value in success.items() if key.startswith(prefix) and key[len(prefix):] != "transitiontime"}
+    if success.get(prefix + "transitiontime"):
+        device.begin_transition(success[prefix + "transitiontime"] / 10, state)
+    if state:
+        device.apply_state(state)
 
 
 ### Services ###
 
 
 def set_light_power(device: Device, power: bool):
-    err, body = put(
-        url=f"https://{device.bridge.host}/api/{device.bridge.api_key}/lights/{device.number}/state",
-        payload={
+    err, body = get_backend(device.bridge).set_light_state(
+        number=device.number,
+        state={
             "on": power
-        },
-        timeout=device.bridge.request_timeout
+        }
     )
     if err:
         logger.error("set power for '{}' failed - {}".format(device.id, body))
+    else:
+        apply_success(device, body)
     return {"status": err}
 
 
@@ -117,10 +111,7 @@ def get_light_power(device: Device):
         "status": 0,
         "time": "{}Z".format(datetime.datetime.utcnow().isoformat())
     }
-    err, body = get(
-        url=f"https://{device.bridge.host}/api/{device.bridge.api_key}/lights/{device.number}",
-        timeout=device.bridge.request_timeout
-    )
+    err, body = read_light_state(device)
     if err:
         logger.warning("get power for '{}' failed - using possibly stale data - {}".format(device.id, body))
     else:
@@ -129,17 +120,18 @@ def get_light_power(device: Device):
 
 
 def set_light_color(device: Device, red: int, green: int, blue: int, duration: float):
-    err, body = put(
-        url=f"https://{device.bridge.host}/api/{device.bridge.api_key}/lights/{device.number}/state",
-        payload={
+    err, body = get_backend(device.bridge).set_light_state(
+        number=device.number,
+        state={
             "on": True,
             "xy": get_converter(device.model_id).rgb_to_xy(red=red, green=green, blue=blue),
             "transitiontime": int(duration * 10)
-        },
-        timeout=device.bridge.request_timeout
+        }
     )
     if err:
         logger.error("set color for '{}' failed - {}".format(device.id, body))
+    else:
+        apply_success(device, body)
     return {"status": err}
 
 
@@ -152,10 +144,7 @@ def get_light_color(device: Device):
         "status": 0,
         "time": "{}Z".format(datetime.datetime.utcnow().isoformat())
     }
-    err, body = get(
-        url=f"https://{device.bridge.host}/api/{device.bridge.api_key}/lights/{device.number}",
-        timeout=device.bridge.request_timeout
-    )
+    err, body = read_light_state(device)
     if err:
         logger.warning("get color for '{}' failed - using possibly stale data - {}".format(device.id, body))
     else:
@@ -167,17 +156,18 @@ def get_light_color(device: Device):
 
 
 def set_light_brightness(device: Device, brightness: int, duration: float):
-    err, body = put(
-        url=f"https://{device.bridge.host}/api/{device.bridge.api_key}/lights/{device.number}/state",
-        payload={
+    err, body = get_backend(device.bridge).set_light_state(
+        number=device.number,
+        state={
             "on": True,
             "bri": round(brightness * 255 / 100),
             "transitiontime": int(duration * 10)
-        },
-        timeout=device.bridge.request_timeout
+        }
     )
     if err:
         logger.error("set brightness for '{}' failed - {}".format(device.id, body))
+    else:
+        apply_success(device, body)
     return {"status": err}
 
 
@@ -187,10 +177,7 @@ def get_light_brightness(device: Device):
         "status": 0,
         "time": "{}Z".format(datetime.datetime.utcnow().isoformat())
     }
-    err, body = get(
-        url=f"https://{device.bridge.host}/api/{device.bridge.api_key}/lights/{device.number}",
-        timeout=device.bridge.request_timeout
-    )
+    err, body = read_light_state(device)
     if err:
         logger.warning("get brightness for '{}' failed - using possibly stale data - {}".format(device.id, body))
     else:
@@ -199,17 +186,18 @@ def get_light_brightness(device: Device):
 
 
 def set_light_kelvin(device: Device, kelvin: int, duration: float):
-    err, body = put(
-        url=f"https://{device.bridge.host}/api/{device.bridge.api_key}/lights/{device.number}/state",
-        payload={
+    err, body = get_backend(device.bridge).set_light_state(
+        number=device.number,
+        state={
             "on": True,
             "ct": round(1000000 / kelvin),
             "transitiontime": int(duration * 10)
-        },
-        timeout=device.bridge.request_timeout
+        }
     )
     if err:
         logger.error("set kelvin for '{}' failed - {}".format(device.id, body))
+    else:
+        apply_success(device, body)
     return {"status": err}
 
 
@@ -219,10 +207,7 @@ def get_light_kelvin(device: Device):
         "status": 0,
         "time": "{}Z".format(datetime.datetime.utcnow().isoformat())
     }
-    err, body = get(
-        url=f"https://{device.bridge.host}/api/{device.bridge.api_key}/lights/{device.number}",
-        timeout=device.bridge.request_timeout
-    )
+    err, body = read_light_state(device)
     if err:
         logger.warning("get brightness for '{}' failed - using possibly stale data - {}".format(device.id, body))
     else:
@@ -230,6 +215,73 @@ def get_light_kelvin(device: Device):
     return payload
 
 
+def set_light_state(device: Device, power: bool = None, brightness: int = None, red: int = None, green: int = None, blue: int = None, kelvin: int = None, duration: float = 0):
+    payload = dict()
+    if any(value is not None for value in (red, green, blue)):
+        if kelvin is not None:
+            logger.error("set state for '{}' failed - color and kelvin are mutually exclusive".format(device.id))
+            return {"status": 1}
+        payload["xy"] = get_converter(device.model_id).rgb_to_xy(red=red or 0, green=green or 0, blue=blue or 0)
+    if kelvin is not None:
+        payload["ct"] = round(1000000 / kelvin)
+    if brightness is not None:
+        payload["bri"] = round(brightness * 255 / 100)
+    if power is not None:
+        payload["on"] = power
+    elif payload:
+        payload["on"] = True
+    if not payload:
+        logger.error("set state for '{}' failed - no attributes given".format(device.id))
+        return {"status": 1}
+    payload["transitiontime"] = int(duration * 10)
+    err, body = get_backend(device.bridge).set_light_state(
+        number=device.number,
+        state=payload
+    )
+    if err:
+        logger.error("set state for '{}' failed - {}".format(device.id, body))
+    else:
+        apply_success(device, body)
+    return {"status": err}
+
+
+def recall_scene(device: Device, scene: str, group: str = "0"):
+    err, body = get_backend(device.bridge).set_group_action(
+        group=group,
+        action={
+            "scene": scene
+        }
+    )
+    if err:
+        logger.error("recall scene '{}' for '{}' failed - {}".format(scene, device.id, body))
+    else:
+        device.invalidate_state()
+    return {"status": err}
+
+
+def set_group_state(device: Device, group: str = "0", power: bool = None, brightness: int = None, duration: float = 0):
+    action = dict()
+    if brightness is not None:
+        action["bri"] = round(brightness * 255 / 100)
+    if power is not None:
+        action["on"] = power
+    elif action:
+        action["on"] = True
+    if not action:
+        logger.error("set group state for '{}' failed - no attributes given".format(device.id))
+        return {"status": 1}
+    action["transitiontime"] = int(duration * 10)
+    err, body = get_backend(device.bridge).set_group_action(
+        group=group,
+        action=action
+    )
+    if err:
+        logger.error("set group state '{}' for '{}' failed - {}".format(group, device.id, body))
+    else:
+        device.invalidate_state()
+    return {"status": err}
+
+
 def get_sensor_presence(device: Device):
     return {
         "presence": device.data["state"]["presence"],
@@ -251,6 +303,22 @@ def get_button_event(device: Device):
     }
 
 
+def get_history(device: Device, since: str = None, key: str = None, limit: int = None):
+    if device.history is None:
+        return {"history": []}
+    if since:
+        since = datetime.datetime.fromisoformat(since.rstrip("Z")).replace(tzinfo=datetime.timezone.utc).timestamp()
+    return {
+        "history": [
+            {
+                "time": "{}Z".format(datetime.datetime.utcfromtimestamp(timestamp).isoformat()),
+                "key": name,
+                "value": value
+            } for timestamp, name, value in device.history.query(since=since, key=key, limit=limit)
+        ]
+    }
+
+
 service_map = {
     "setPower": set_light_power,
     "getPower": get_light_power,
@@ -260,9 +328,13 @@ service_map = {
     "getBrightness": get_light_brightness,
     "setKelvin": set_light_kelvin,
     "getKelvin": get_light_kelvin,
+    "setState": set_light_state,
+    "recallScene": recall_scene,
+    "setGroupState": set_group_state,
     "getPresence": get_sensor_presence,
     "getBattery": get_sensor_battery,
-    "getButtonEvent": get_button_event
+    "getButtonEvent": get_button_event,
+    "getHistory": get_history
 }
 
 event_service_map = {
@@ -270,3 +342,11 @@ event_service_map = {
     "battery": "getBattery",
     "buttonevent": "getButtonEvent"
 }
+
+set_services = frozenset(key for key in service_map if key.startswith("set")) | {"recallScene"}
+
+# only read Device.data, answered without a worker
+cache_services = frozenset({"getPresence", "getBattery", "getButtonEvent", "getHistory"})
+
+# a newer command of these services fully overrides an older one
+coalesce_services = frozenset({"setPower", "setBrightness", "setColor", "setKelvin"})
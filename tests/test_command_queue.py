@@ -0,0 +1,64 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from hue_bridge.history import History, HistoryStore
+import unittest
+from hue_bridge.command_queue import CommandQueue
+import unittest
+import queue
+
+
+def drain(command_queue: CommandQueue) -> list:
+    items = list()
+    while command_queue.qsize():
+        items.append(command_queue.get(timeout=0)[0])
+    return items
+
+
+class TestCommandQueue(unittest.TestCase):
+    def test_priority_order(self):
+        command_queue = CommandQueue(maxsize=10, ttl=30)
+        command_queue.put("getPower", 1)
+        command_queue.put("setPower", 0)
+        command_queue.put("setColor", 0)
+        self.assertEqual(drain(command_queue), ["setPower", "setColor", "getPower"])
+
+    def test_coalesce_last(self):
+        command_queue = CommandQueue(maxsize=10, ttl=30)
+        command_queue.put("setPower off", 0, "setPower")
+        command_queue.put("setBrightness 50", 0, "setBrightness")
+        self.assertEqual(command_queue.put("setBrightness 80", 0, "setBrightness"), "setBrightness 50")
+        self.assertEqual(drain(command_queue), ["setPower off", "setBrightness 80"])
+
+    def test_coalesce_keeps_order(self):
+        command_queue = CommandQueue(maxsize=10, ttl=30)
+        command_queue.put("setBrightness 50", 0, "setBrightness")
+        command_queue.put("setPower off", 0, "setPower")
+        self.assertEqual(command_queue.put("setBrightness 80", 0, "setBrightness"), "setBrightness 50")
+        self.assertEqual(drain(command_queue), ["setPower off", "setBrightness 80"])
+        self.assertEqual(command_queue.stats["superseded"], 1)
+
+    def test_full(self):
+        command_queue = CommandQueue(maxsize=1, ttl=30)
+        command_queue.put("setPower", 0, "setPower")
+        self.assertEqual(command_queue.put("setPower on", 0, "setPower"), "setPower")
+        with self.assertRaises(queue.Full):
+            command_queue.put("getPower", 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
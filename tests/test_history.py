@@ -0,0 +1,48 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+
+from hue_bridge.history import History, HistoryStore
+import unittest
+
+
+class TestHistory(unittest.TestCase):
+    def test_record_query(self):
+        history = History(3)
+        for num in range(4):
+            history.record(float(num), "state.bri" if num % 2 else "state.on", num)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.query(), [(1.0, "state.bri", 1), (2.0, "state.on", 2), (3.0, "state.bri", 3)])
+        self.assertEqual(history.query(since=2.0), [(2.0, "state.on", 2), (3.0, "state.bri", 3)])
+        self.assertEqual(history.query(key="state.bri", limit=1), [(3.0, "state.bri", 3)])
+
+
+class TestHistoryStore(unittest.TestCase):
+    def test_allocate_forget(self):
+        store = HistoryStore(size=10, total_size=15)
+        first = store.allocate("a")
+        self.assertIsNotNone(first)
+        self.assertIs(store.allocate("a"), first)
+        self.assertEqual(store.allocate("b").size, 5)
+        self.assertIsNone(store.allocate("c"))
+        # histories without entries still hold their budget
+        store.forget("a")
+        self.assertEqual(store.stats["allocated"], 5)
+        self.assertEqual(store.allocate("c").size, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,21 +15,38 @@
 """
 
 
-from .config import *
 from .logger import *
-from .mqtt import *
-from .router import *
+import importlib
 import sys
 import random
 import time
 
 
-__all__ = (
-    config.__all__,
-    logger.__all__,
-    mqtt.__all__,
-    router.__all__
-)
+# logging is needed everywhere, everything else is imported on first attribute access (PEP 562)
+_exports = {
+    "config": ("Conf", ),
+    "mqtt": ("MQTTClient", "msg_class", "buffer_policy"),
+    "profiler": ("StageTimers", "timers", "SamplingProfiler", "gen_profile_topic"),
+    "recorder": ("Recorder", "record_kind"),
+    "router": ("Router", ),
+    "shard": ("ProxyMQTTClient", "MQTTFrontend", "Supervisor")
+}
+
+_modules = {name: module for module, names in _exports.items() for name in names}
+
+__all__ = logger.__all__ + tuple(_modules)
+
+
+def __getattr__(name):
+    if name not in _modules:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+    value = getattr(importlib.import_module("." + _modules[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
 
 
 def handle_sigterm(signo, stack_frame):
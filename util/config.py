@@ -32,29 +32,98 @@ class Conf:
     class Logger:
         level = "info"
         enable_mqtt = False
+        json_format = False
+        rate_limit = 0
 
     @simple_env_var.section
     class Client:
         clean_session = False
         keep_alive = 10
         id = "hue-bridge-dc"
+        qos_events = 1
+        qos_responses = 1
+        qos_device_manager = 1
+        max_inflight = 20
+        max_queued = 0
+        buffer_size = 1000
+        buffer_policy = "drop_oldest"
+        reconnect_delay_min = 1
+        reconnect_delay_max = 120
+        wildcard_commands = False
+        dispatchers = 1
+
+    @simple_env_var.section
+    class History:
+        size = 100
+        total_size = 100000
+
+    @simple_env_var.section
+    class Profiler:
+        stage_timers = True
+        directory = "/tmp/profiles"
+        interval = 0.01
+        max_duration = 60
+        mqtt_control = False
+
+    @simple_env_var.section
+    class Supervisor:
+        bridges = None
+        shards = 0
+        restart_delay = 5
+
+    @simple_env_var.section
+    class Recorder:
+        enabled = False
+        directory = "/tmp/records"
+        max_size = 104857600
 
     @simple_env_var.section
     class Bridge:
         api_key = None
         id = None
+        api_version = "v1"
 
     @simple_env_var.section
     class Discovery:
         nupnp_url = "https://discovery.meethue.com"
         device_query_delay = 10
+        raw_poll_parser = False
+        read_batch_window = 0
+        refresh_batch_size = 50
+        refresh_batch_delay = 0.1
+        refresh_jitter = 5
+        refresh_full = False
         device_id_prefix = None
         delay = 30
         check_delay = 60
-        check_fail_safe = 2
+        breaker_threshold = 3
+        breaker_reset = 30
         timeout = 5
         ip_file = "/opt/host_ip"
 
+    @simple_env_var.section
+    class Commands:
+        worker_queue_size = 50
+        ttl = 30
+        stats_interval = 300
+
+    @simple_env_var.section
+    class Events:
+        debounce = 0
+        batch = False
+        stats_interval = 300
+
+    @simple_env_var.section
+    class Entertainment:
+        enabled = False
+        group = None
+        client_key = None
+        transport = "dtls"
+        port = 2100
+        rate = 25
+        max_frame_age = 0.2
+        idle_timeout = 10
+
     @simple_env_var.section
     class StartDelay:
         enabled = False
@@ -18,6 +18,9 @@ __all__ = ("get_logger", "init_logger")
 
 
 import logging
+import threading
+import time
+import json
 
 
 logging_levels = {
@@ -37,6 +40,54 @@ msg_fmt = '%(asctime)s - %(levelname)s: [%(name)s] %(message)s'
 date_fmt = '%m.%d.%Y %I:%M:%S %p'
 
 
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        msg = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "suppressed", 0):
+            msg["suppressed"] = record.suppressed
+        if record.exc_info:
+            msg["exception"] = self.formatException(record.exc_info)
+        return json.dumps(msg)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets the first record of a logger, level and message template pass and suppresses repetitions for interval
+    seconds. The next record after the interval carries the number of suppressed records.
+    Only warnings and errors are limited. Warnings are keyed by their formatted message, so per device or per
+    command warnings sharing a template still pass.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__()
+        self.__interval = interval
+        self.__records = dict()
+        self.__lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.msg if record.levelno > logging.WARNING else record.getMessage())
+        now = time.monotonic()
+        with self.__lock:
+            last, suppressed = self.__records.get(key, (None, 0))
+            if last is not None and now - last < self.__interval:
+                self.__records[key] = (last, suppressed + 1)
+                return False
+            self.__records[key] = (now, 0)
+            if len(self.__records) > 1000:
+                self.__records = {k: v for k, v in self.__records.items() if now - v[0] < self.__interval}
+        record.suppressed = suppressed
+        if suppressed:
+            record.msg = "{} (suppressed {} similar messages)".format(record.msg, suppressed)
+        return True
+
+
 handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter(fmt=msg_fmt, datefmt=date_fmt))
 
@@ -45,11 +96,15 @@ logger.propagate = False
 logger.addHandler(handler)
 
 
-def init_logger(level):
+def init_logger(level, json_format: bool = False, rate_limit: float = 0):
     if level not in logging_levels.keys():
         err = "unknown log level '{}'".format(level)
         raise LoggerError(err)
     logger.setLevel(logging_levels[level])
+    if json_format:
+        handler.setFormatter(JSONFormatter())
+    if rate_limit:
+        handler.addFilter(RateLimitFilter(rate_limit))
 
 
 def get_logger(name: str) -> logging.Logger:
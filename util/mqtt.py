@@ -14,11 +14,17 @@
    limitations under the License.
 """
 
-__all__ = ("MQTTClient", )
+__all__ = ("MQTTClient", "msg_class", "buffer_policy")
 
 
 from .logger import get_logger
+from .profiler import timers
 import paho.mqtt.client
+import collections
+import threading
+import queue
+import typing
+import random
 import time
 import mgw_dc
 
@@ -26,71 +32,265 @@ import mgw_dc
 logger = get_logger(__name__.split(".", 1)[-1])
 
 
+class msg_class:
+    event = "event"
+    response = "response"
+    device_manager = "device_manager"
+
+
+class buffer_policy:
+    drop_oldest = "drop_oldest"
+    drop_newest = "drop_newest"
+
+
 class MQTTClient:
-    def __init__(self, host: str, port: int, client_id: str, clean_session: bool, keep_alive: int, sub_lvl_logger=False):
+    def __init__(self, host: str, port: int, client_id: str, clean_session: bool, keep_alive: int, sub_lvl_logger=False, qos: typing.Optional[typing.Dict[str, int]] = None, max_inflight: int = 20, max_queued: int = 0, buffer_size: int = 1000, buffer_policy: str = buffer_policy.drop_oldest, reconnect_delay_min: int = 1, reconnect_delay_max: int = 120, dispatchers: int = 1):
         self.__host = host
         self.__port = port
         self.__keep_alive = keep_alive
+        self.__reconnect_delay_min = reconnect_delay_min
+        self.__reconnect_delay_max = reconnect_delay_max
+        self.__qos = {msg_class.event: 1, msg_class.response: 1, msg_class.device_manager: 1}
+        self.__qos.update(qos or {})
+        self.__buffer = collections.deque()
+        self.__buffer_size = buffer_size
+        self.__buffer_policy = buffer_policy
+        self.__buffer_lock = threading.Lock()
+        self.__dropped = 0
+        self.__drop_notified = False
+        self.__replayed = 0
+        # inbound messages are handed off to dispatcher threads so the network loop only does socket work
+        # every dispatcher has its own queue, messages are assigned by topic without the last level (the service of a
+        # command topic) so that commands for the same device are handled in order
+        self.__inbound = [queue.SimpleQueue() for _ in range(max(dispatchers, 1))]
+        self.__dispatchers = [threading.Thread(target=self.__dispatch, args=(inbound, ), name="mqtt-dispatcher-{}".format(num), daemon=True) for num, inbound in enumerate(self.__inbound)]
+        self.__dispatch_stats = {"dispatched": 0, "max_depth": 0, "wait_total": 0.0, "wait_max": 0.0}
+        self.__pending_acks = dict()
+        self.__ack_stats = {"acked": 0, "latency_total": 0.0, "latency_max": 0.0}
+        self.__ping_time = None
+        self.__ping_latency = None
         self.__client = paho.mqtt.client.Client(
             client_id=client_id,
             clean_session=clean_session
         )
+        self.__client.max_inflight_messages_set(max_inflight)
+        self.__client.max_queued_messages_set(max_queued)
+        # randomised lower bound so that gateways losing the broker at the same time don't reconnect in lockstep
+        self.__client.reconnect_delay_set(
+            min_delay=random.uniform(reconnect_delay_min, reconnect_delay_min * 2),
+            max_delay=reconnect_delay_max
+        )
         self.__client.on_connect = self.__on_connect
         self.__client.on_disconnect = self.__on_disconnect
         self.__client.on_message = self.__on_message
+        self.__client.on_publish = self.__on_publish
         self.__client.will_set(topic=mgw_dc.dm.gen_last_will_topic(client_id), payload="1", qos=2)
         if sub_lvl_logger:
             self.__client.enable_logger(logger)
         self.connected = self.__client.is_connected
+        self.__subscriptions = dict()
         self.on_connect = None
         self.on_message = None
+        self.on_drop = None
 
     def __on_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            logger.info("connected to '{}'".format(self.__host))
+            logger.info("connected to '%s'", self.__host)
             self.__client.subscribe(mgw_dc.dm.gen_refresh_topic(), 1)
-            self.on_connect(True)
+            for topic, qos in self.__subscriptions.items():
+                self.__client.subscribe(topic, qos)
+            self.__replay()
+            session_present = bool(flags.get("session present"))
+            if session_present:
+                logger.info("session present on '%s' - skipping resubscribe", self.__host)
+            self.__inbound[0].put((time.monotonic(), self.on_connect, (not session_present,)))
         else:
-            logger.error("could not connect to '{}' - {}".format(self.__host, paho.mqtt.client.connack_string(rc)))
+            logger.error("could not connect to '%s' - %s", self.__host, paho.mqtt.client.connack_string(rc))
 
     def __on_disconnect(self, client, userdata, rc):
         if rc == 0:
-            logger.info("disconnected from '{}'".format(self.__host))
+            logger.info("disconnected from '%s'", self.__host)
         else:
-            logger.warning("disconnected from '{}' unexpectedly".format(self.__host))
+            logger.warning("disconnected from '%s' unexpectedly", self.__host)
 
     def __on_message(self, client, userdata, message: paho.mqtt.client.MQTTMessage):
-        self.on_message(message.topic, message.payload)
+        inbound = self.__inbound[hash(message.topic.rsplit("/", 1)[0]) % len(self.__inbound)] if len(self.__inbound) > 1 else self.__inbound[0]
+        inbound.put((time.monotonic(), self.on_message, (message.topic, message.payload)))
+
+    def __on_publish(self, client, userdata, mid):
+        sent = self.__pending_acks.pop(mid, None)
+        if sent is not None:
+            latency = time.monotonic() - sent
+            self.__ack_stats["acked"] += 1
+            self.__ack_stats["latency_total"] += latency
+            if latency > self.__ack_stats["latency_max"]:
+                self.__ack_stats["latency_max"] = latency
+        # an ack frees room in paho's queue, skipped if a publish on this or another thread holds the buffer
+        if self.__buffer and self.__buffer_lock.acquire(blocking=False):
+            try:
+                self.__drain()
+            finally:
+                self.__buffer_lock.release()
+
+    def __on_log(self, client, userdata, level, buf):
+        if buf == "Sending PINGREQ":
+            self.__ping_time = time.monotonic()
+        elif buf == "Received PINGRESP" and self.__ping_time is not None:
+            self.__ping_latency = time.monotonic() - self.__ping_time
+            self.__ping_time = None
+            # paho formats every log message while a hook is set, so it is only installed until one ping is timed
+            self.__client.on_log = None
+
+    def __dispatch(self, inbound: queue.SimpleQueue):
+        while True:
+            queued, callback, args = inbound.get()
+            wait = time.monotonic() - queued
+            stats = self.__dispatch_stats
+            stats["dispatched"] += 1
+            stats["wait_total"] += wait
+            if wait > stats["wait_max"]:
+                stats["wait_max"] = wait
+            depth = inbound.qsize()
+            if depth > stats["max_depth"]:
+                stats["max_depth"] = depth
+            try:
+                callback(*args)
+            except Exception as ex:
+                logger.error("handling inbound message failed - %s", ex)
 
     def start(self):
+        for dispatcher in self.__dispatchers:
+            dispatcher.start()
+        delay = self.__reconnect_delay_min
         while True:
             try:
                 self.__client.connect(self.__host, self.__port, keepalive=self.__keep_alive)
                 self.__client.loop_forever()
                 break
             except Exception as ex:
-                logger.error(
-                    "could not connect to '{}' on '{}' - {}".format(self.__host, self.__port, ex)
-                )
-                time.sleep(5)
+                wait = random.uniform(delay / 2, delay)
+                logger.error("could not connect to '%s' on '%s' - %s - retrying in %.1fs", self.__host, self.__port, ex, wait)
+                time.sleep(wait)
+                delay = min(delay * 2, self.__reconnect_delay_max)
+
+    def add_subscription(self, topic: str, qos: int) -> None:
+        # subscribed on every connect
+        self.__subscriptions[topic] = qos
 
     def subscribe(self, topic: str, qos: int) -> None:
         res = self.__client.subscribe(topic=topic, qos=qos)
         if res[0] is paho.mqtt.client.MQTT_ERR_SUCCESS:
-            logger.debug("subscribed to '{}'".format(topic))
+            logger.debug("subscribed to '%s'", topic)
         else:
             raise RuntimeError(paho.mqtt.client.error_string(res[0]).replace(".", "").lower())
 
     def unsubscribe(self, topic: str) -> None:
         res = self.__client.unsubscribe(topic=topic)
         if res[0] is paho.mqtt.client.MQTT_ERR_SUCCESS:
-            logger.debug("unsubscribed from '{}'".format(topic))
+            logger.debug("unsubscribed from '%s'", topic)
         else:
             raise RuntimeError(paho.mqtt.client.error_string(res[0]).replace(".", "").lower())
 
-    def publish(self, topic: str, payload: str, qos: int) -> None:
+    def publish(self, topic: str, payload: str, msg_cls: str) -> None:
+        qos = self.__qos[msg_cls]
+        with timers.measure("mqtt.publish"), self.__buffer_lock:
+            if self.__buffer and self.__client.is_connected():
+                # resume an interrupted replay first so buffered messages keep their order
+                self.__drain()
+            if self.__buffer or not self.__client.is_connected():
+                self.__buffer_message(topic, payload, qos)
+                return
+            self.__publish(topic, payload, qos)
+
+    def __publish(self, topic: str, payload: str, qos: int):
         msg_info = self.__client.publish(topic=topic, payload=payload, qos=qos, retain=False)
         if msg_info.rc == paho.mqtt.client.MQTT_ERR_SUCCESS:
-            logger.debug("published '{}' - (q{}, m{})".format(payload, qos, msg_info.mid))
+            if qos and not msg_info.is_published():
+                self.__track_ack(msg_info.mid)
+            logger.debug("published '%s' - (q%s, m%s)", payload, qos, msg_info.mid)
+        elif msg_info.rc == paho.mqtt.client.MQTT_ERR_NO_CONN and qos == 0:
+            self.__buffer_message(topic, payload, qos)
+        elif msg_info.rc == paho.mqtt.client.MQTT_ERR_NO_CONN:
+            # paho keeps qos > 0 messages and sends them after reconnecting
+            logger.debug("queued '%s' - (q%s, m%s)", payload, qos, msg_info.mid)
         else:
             raise RuntimeError(paho.mqtt.client.error_string(msg_info.rc).replace(".", "").lower())
+
+    def __track_ack(self, mid: int):
+        if len(self.__pending_acks) >= 10000:
+            # acks lost with a discarded session
+            self.__pending_acks.clear()
+        self.__pending_acks[mid] = time.monotonic()
+
+    def __buffer_message(self, topic: str, payload: str, qos: int):
+        if self.__buffer_size <= 0:
+            raise RuntimeError(paho.mqtt.client.error_string(paho.mqtt.client.MQTT_ERR_NO_CONN).replace(".", "").lower())
+        if len(self.__buffer) >= self.__buffer_size:
+            if not self.__dropped:
+                logger.warning("offline buffer full - dropping messages (%s)", self.__buffer_policy)
+            self.__dropped += 1
+            if not self.__drop_notified:
+                # once until the buffer was drained again
+                self.__drop_notified = True
+                if self.on_drop:
+                    self.on_drop()
+            if self.__buffer_policy == buffer_policy.drop_newest:
+                return
+            self.__buffer.popleft()
+        self.__buffer.append((topic, payload, qos))
+
+    def __drain(self) -> int:
+        # caller holds the buffer lock
+        count = 0
+        rc = paho.mqtt.client.MQTT_ERR_SUCCESS
+        while self.__buffer:
+            topic, payload, qos = self.__buffer[0]
+            msg_info = self.__client.publish(topic=topic, payload=payload, qos=qos, retain=False)
+            rc = msg_info.rc
+            if rc != paho.mqtt.client.MQTT_ERR_SUCCESS:
+                break
+            if qos and not msg_info.is_published():
+                self.__track_ack(msg_info.mid)
+            self.__buffer.popleft()
+            count += 1
+        self.__replayed += count
+        if not self.__buffer:
+            self.__drop_notified = False
+        return rc
+
+    def __replay(self):
+        with self.__buffer_lock:
+            replayed = self.__replayed
+            rc = self.__drain()
+            count = self.__replayed - replayed
+        if rc != paho.mqtt.client.MQTT_ERR_SUCCESS:
+            logger.warning("replaying offline buffer interrupted - %s", paho.mqtt.client.error_string(rc))
+        if count:
+            logger.info("replayed %s buffered messages", count)
+
+    def measure_keepalive(self):
+        # times the next ping, reported as keepalive_latency by stats once the response arrived
+        self.__client.on_log = self.__on_log
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self.__buffer),
+            "buffer_size": self.__buffer_size,
+            "dropped": self.__dropped,
+            "replayed": self.__replayed,
+            "inbound": {
+                "depth": sum(inbound.qsize() for inbound in self.__inbound),
+                "max_depth": self.__dispatch_stats["max_depth"],
+                "dispatched": self.__dispatch_stats["dispatched"],
+                "wait_avg": self.__dispatch_stats["wait_total"] / (self.__dispatch_stats["dispatched"] or 1),
+                "wait_max": self.__dispatch_stats["wait_max"]
+            },
+            "ack": {
+                "pending": len(self.__pending_acks),
+                "acked": self.__ack_stats["acked"],
+                "latency_avg": self.__ack_stats["latency_total"] / (self.__ack_stats["acked"] or 1),
+                "latency_max": self.__ack_stats["latency_max"]
+            },
+            "keepalive_latency": self.__ping_latency
+        }
@@ -0,0 +1,155 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("StageTimers", "timers", "SamplingProfiler", "gen_profile_topic")
+
+
+from .logger import get_logger
+import collections
+import contextlib
+import threading
+import typing
+import time
+import sys
+import os
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+def gen_profile_topic(dc_id: str) -> str:
+    return "profile/{}".format(dc_id)
+
+
+class StageTimers:
+    def __init__(self):
+        self.__stages = dict()
+        self.__lock = threading.Lock()
+        self.enabled = True
+
+    @contextlib.contextmanager
+    def measure(self, stage: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, duration: float) -> None:
+        with self.__lock:
+            stats = self.__stages.get(stage)
+            if stats is None:
+                self.__stages[stage] = [1, duration, duration]
+            else:
+                stats[0] += 1
+                stats[1] += duration
+                if duration > stats[2]:
+                    stats[2] = duration
+
+    @property
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                stage: {"count": count, "total": total, "avg": total / count, "max": max_duration}
+                for stage, (count, total, max_duration) in self.__stages.items()
+            }
+
+
+timers = StageTimers()
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads every interval seconds and writes them in collapsed stack format
+    ("thread;module:function;... count") to directory, ready for flamegraph.pl or speedscope. Runs stop on their
+    own after max_duration seconds.
+    """
+
+    def __init__(self, directory: str, interval: float = 0.01, max_duration: float = 60):
+        self.__directory = directory
+        self.__interval = interval
+        self.__max_duration = max_duration
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.__lock = threading.Lock()
+
+    def start(self, duration: typing.Optional[float] = None) -> bool:
+        with self.__lock:
+            if self.__thread and self.__thread.is_alive():
+                return False
+            duration = min(duration or self.__max_duration, self.__max_duration)
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, args=(duration, ), name="profiler", daemon=True)
+            self.__thread.start()
+            return True
+
+    def stop(self) -> None:
+        self.__stop.set()
+
+    def toggle(self) -> None:
+        if not self.start():
+            self.stop()
+
+    def handle_signal(self, signo, stack_frame):
+        self.toggle()
+
+    def handle_message(self, payload: typing.AnyStr):
+        # "stop" ends a running profile, anything else starts one, a number sets the duration in seconds
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        payload = payload.strip()
+        if payload == "stop":
+            self.stop()
+        else:
+            try:
+                duration = float(payload) if payload else None
+            except ValueError:
+                duration = None
+            if not self.start(duration):
+                logger.warning("profiler already running")
+
+    def __run(self, duration: float):
+        logger.info("profiling for up to %ss", duration)
+        own_id = threading.get_ident()
+        stacks = collections.Counter()
+        samples = 0
+        end = time.monotonic() + duration
+        while not self.__stop.is_set() and time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = list()
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+            self.__stop.wait(self.__interval)
+        path = os.path.join(self.__directory, "profile-{}.folded".format(time.strftime("%Y%m%d-%H%M%S")))
+        try:
+            os.makedirs(self.__directory, exist_ok=True)
+            with open(path, "w") as file:
+                for stack, count in stacks.items():
+                    file.write("{} {}\n".format(stack, count))
+            logger.info("wrote %s samples to '%s'", samples, path)
+        except Exception as ex:
+            logger.error("could not write profile - %s", ex)
@@ -0,0 +1,81 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("Recorder", "record_kind")
+
+
+from .logger import get_logger
+import threading
+import hashlib
+import typing
+import json
+import time
+import os
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class record_kind:
+    poll = "poll"
+    message = "message"
+
+
+class Recorder:
+    """
+    Writes timestamped bridge poll responses and inbound MQTT messages as JSON lines for offline replay. Poll
+    responses identical to the previous one of the same api are recorded without body. Recording stops once
+    the file reaches max_size bytes.
+    """
+
+    def __init__(self, directory: str, name: str, max_size: int = 0):
+        os.makedirs(directory, exist_ok=True)
+        self.__path = os.path.join(directory, "record-{}-{}.jsonl".format(name, time.strftime("%Y%m%d-%H%M%S")))
+        self.__file = open(self.__path, "a", buffering=1)
+        self.__max_size = max_size
+        self.__size = 0
+        self.__digests = dict()
+        self.__lock = threading.Lock()
+        logger.info("recording to '%s'", self.__path)
+
+    def __write(self, record: dict):
+        line = json.dumps(record) + "\n"
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.write(line)
+            self.__size += len(line)
+            if self.__max_size and self.__size >= self.__max_size:
+                logger.warning("recording stopped - '%s' reached %s bytes", self.__path, self.__size)
+                self.__file.close()
+                self.__file = None
+
+    def record_poll(self, api: str, body: bytes):
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if self.__digests.get(api) == digest:
+            self.__write({"t": time.time(), "kind": record_kind.poll, "api": api, "same": True})
+        else:
+            self.__digests[api] = digest
+            self.__write({"t": time.time(), "kind": record_kind.poll, "api": api, "body": body.decode()})
+
+    def record_message(self, topic: str, payload: typing.AnyStr):
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        self.__write({"t": time.time(), "kind": record_kind.message, "topic": topic, "payload": payload})
+
+    @property
+    def path(self) -> str:
+        return self.__path
@@ -27,15 +27,42 @@ logger = get_logger(__name__.split(".", 1)[-1])
 
 
 class Router:
-    def __init__(self, refresh_callback: typing.Callable, command_callback: typing.Callable):
-        self.__refresh_callback = refresh_callback
+    def __init__(self, refresh_callback: typing.Callable, command_callback: typing.Callable, topic_callbacks: typing.Optional[typing.Dict[str, typing.Callable]] = None, known_devices: typing.Optional[typing.Container[str]] = None, cache_size: int = 10000, recorder=None):
         self.__command_callback = command_callback
+        self.__known_devices = known_devices
+        self.__table = {mgw_dc.dm.gen_refresh_topic(): lambda payload: refresh_callback()}
+        self.__table.update(topic_callbacks or dict())
+        # derive the command topic layout from mgw_dc once instead of parsing every topic generically
+        probe = mgw_dc.com.gen_command_topic("\0", "\1")
+        self.__cmd_prefix = probe[:probe.index("\0")]
+        self.__cmd_separator = probe[probe.index("\0") + 1:probe.index("\1")]
+        self.__commands = dict()
+        self.__cache_size = cache_size
+        self.__recorder = recorder
+
+    def __parse_command_topic(self, topic: str) -> typing.Tuple[str, str]:
+        if not topic.startswith(self.__cmd_prefix):
+            raise ValueError("unknown topic")
+        dev_id, sep, srv_id = topic[len(self.__cmd_prefix):].partition(self.__cmd_separator)
+        if not sep or not dev_id or not srv_id:
+            raise ValueError("malformed command topic")
+        if len(self.__commands) >= self.__cache_size:
+            self.__commands.clear()
+        self.__commands[topic] = (dev_id, srv_id)
+        return dev_id, srv_id
 
     def route(self, topic: str, payload: typing.AnyStr):
         try:
-            if topic == mgw_dc.dm.gen_refresh_topic():
-                self.__refresh_callback()
-            else:
-                self.__command_callback((*mgw_dc.com.parse_command_topic(topic), payload))
+            if self.__recorder:
+                self.__recorder.record_message(topic, payload)
+            callback = self.__table.get(topic)
+            if callback:
+                callback(payload)
+                return
+            command = self.__commands.get(topic) or self.__parse_command_topic(topic)
+            if self.__known_devices is not None and command[0] not in self.__known_devices:
+                # commands for devices of other connectors when subscribed via wildcard
+                return
+            self.__command_callback((*command, payload))
         except Exception as ex:
-            logger.error("can't route message - {}\n{}: {}".format(ex, topic, payload))
+            logger.error("can't route message - %s\n%s: %s", ex, topic, payload)
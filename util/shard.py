@@ -0,0 +1,267 @@
+"""
+   Copyright 2020 InfAI (CC SES)
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+__all__ = ("ProxyMQTTClient", "MQTTFrontend", "Supervisor")
+
+
+from .logger import get_logger
+from .mqtt import MQTTClient
+import multiprocessing
+import paho.mqtt.client
+import threading
+import typing
+import queue
+import time
+import mgw_dc
+
+
+logger = get_logger(__name__.split(".", 1)[-1])
+
+
+class ProxyMQTTClient:
+    """
+    Stands in for MQTTClient inside a shard process. Outbound calls are put on the queue of the shard,
+    inbound messages and connects arrive on the endpoint's own queue and are handled by start().
+    """
+
+    def __init__(self, endpoint: int, outbound: multiprocessing.Queue, inbound: multiprocessing.Queue):
+        self.__endpoint = endpoint
+        self.__outbound = outbound
+        self.__inbound = inbound
+        self.__connected = False
+        self.__published = 0
+        self.on_connect = None
+        self.on_message = None
+        self.on_drop = None
+        self.add_subscription(mgw_dc.dm.gen_refresh_topic(), 1)
+
+    def connected(self) -> bool:
+        return self.__connected
+
+    def add_subscription(self, topic: str, qos: int) -> None:
+        self.__outbound.put((self.__endpoint, "add_subscription", (topic, qos)))
+
+    def subscribe(self, topic: str, qos: int) -> None:
+        self.__outbound.put((self.__endpoint, "subscribe", (topic, qos)))
+
+    def unsubscribe(self, topic: str) -> None:
+        self.__outbound.put((self.__endpoint, "unsubscribe", (topic, )))
+
+    def publish(self, topic: str, payload: str, msg_cls: str) -> None:
+        self.__outbound.put((self.__endpoint, "publish", (topic, payload, msg_cls)))
+        self.__published += 1
+
+    def measure_keepalive(self):
+        # pings are sent by the front-end's connection
+        pass
+
+    def start(self):
+        while True:
+            kind, *args = self.__inbound.get()
+            try:
+                if kind == "message":
+                    self.on_message(*args)
+                elif kind == "connect":
+                    self.__connected = True
+                    self.on_connect(*args)
+                elif kind == "drop" and self.on_drop:
+                    self.on_drop()
+            except Exception as ex:
+                logger.error("handling inbound '%s' failed - %s", kind, ex)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "endpoint": self.__endpoint,
+            "published": self.__published,
+            "inbound": self.__inbound.qsize()
+        }
+
+
+class MQTTFrontend:
+    """
+    Owns the broker connection for all shards. Forwards the publishes and subscriptions of the endpoints and
+    routes inbound messages to the endpoints subscribed to a matching topic. Every shard has its own outbound
+    queue, a shard killed while writing can only break its own queue, which is replaced on restart.
+    """
+
+    def __init__(self, mqtt_client: MQTTClient, outbound: typing.Iterable[multiprocessing.Queue], inbound: typing.Dict[int, multiprocessing.Queue], cache_size: int = 10000):
+        self.__mqtt_client = mqtt_client
+        self.__outbound = set(outbound)
+        self.__inbound = dict(inbound)
+        self.__filters = dict()
+        self.__routes = dict()
+        self.__cache_size = cache_size
+        self.__lock = threading.Lock()
+        self.__connected = None
+        self.__started = False
+        mqtt_client.on_connect = self.__on_connect
+        mqtt_client.on_message = self.__on_message
+        mqtt_client.on_drop = self.__on_drop
+
+    def __on_connect(self, clean: bool):
+        self.__connected = clean
+        for endpoint in self.__inbound.values():
+            endpoint.put(("connect", clean))
+
+    def __on_drop(self):
+        for endpoint in self.__inbound.values():
+            endpoint.put(("drop", ))
+
+    def __on_message(self, topic: str, payload: bytes):
+        endpoints = self.__routes.get(topic)
+        if endpoints is None:
+            with self.__lock:
+                endpoints = tuple({endpoint for sub, subscribers in self.__filters.items() if paho.mqtt.client.topic_matches_sub(sub, topic) for endpoint in subscribers})
+                if len(self.__routes) >= self.__cache_size:
+                    self.__routes.clear()
+                self.__routes[topic] = endpoints
+        for endpoint in endpoints:
+            self.__inbound[endpoint].put(("message", topic, payload))
+
+    def __add_filter(self, endpoint: int, topic: str) -> bool:
+        with self.__lock:
+            new = topic not in self.__filters
+            self.__filters.setdefault(topic, set()).add(endpoint)
+            self.__routes.clear()
+            return new
+
+    def __remove_filter(self, endpoint: int, topic: str) -> bool:
+        with self.__lock:
+            subscribers = self.__filters.get(topic, set())
+            subscribers.discard(endpoint)
+            self.__routes.clear()
+            if not subscribers:
+                self.__filters.pop(topic, None)
+                return True
+            return False
+
+    def __handle_outbound(self, outbound: multiprocessing.Queue):
+        while outbound in self.__outbound:
+            try:
+                endpoint, op, args = outbound.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                if op == "publish":
+                    self.__mqtt_client.publish(*args)
+                elif op == "add_subscription":
+                    if self.__add_filter(endpoint, args[0]):
+                        self.__mqtt_client.add_subscription(*args)
+                        if self.__mqtt_client.connected():
+                            self.__mqtt_client.subscribe(*args)
+                elif op == "subscribe":
+                    if self.__add_filter(endpoint, args[0]):
+                        self.__mqtt_client.subscribe(*args)
+                elif op == "unsubscribe":
+                    if self.__remove_filter(endpoint, args[0]):
+                        self.__mqtt_client.unsubscribe(*args)
+            except Exception as ex:
+                logger.error("'%s' for endpoint %s failed - %s", op, endpoint, ex)
+
+    def __start_outbound(self, outbound: multiprocessing.Queue):
+        threading.Thread(target=self.__handle_outbound, args=(outbound, ), name="mqtt-frontend", daemon=True).start()
+
+    def replace_outbound(self, old: multiprocessing.Queue, new: multiprocessing.Queue):
+        # called before a shard is restarted, its old queue is no longer read
+        self.__outbound.discard(old)
+        self.__outbound.add(new)
+        if self.__started:
+            self.__start_outbound(new)
+
+    def reset(self, endpoint: int, inbound: typing.Optional[multiprocessing.Queue] = None):
+        # called before the process of an endpoint is restarted, a new inbound queue replaces one the old process may have left locked
+        with self.__lock:
+            for subscribers in self.__filters.values():
+                subscribers.discard(endpoint)
+            self.__routes.clear()
+        if inbound is not None:
+            self.__inbound[endpoint] = inbound
+        inbound = self.__inbound[endpoint]
+        try:
+            while True:
+                inbound.get_nowait()
+        except queue.Empty:
+            pass
+        if self.__connected is not None:
+            inbound.put(("connect", True))
+
+    def start(self):
+        self.__started = True
+        for outbound in list(self.__outbound):
+            self.__start_outbound(outbound)
+        self.__mqtt_client.start()
+
+
+class Supervisor(threading.Thread):
+    """
+    Runs target(shard, *args) in one process per shard and restarts shards that exit, waiting restart_delay
+    seconds, doubled for every consecutive crash within a minute. If on_restart returns arguments they replace the
+    arguments of the restarted shard.
+    """
+
+    def __init__(self, target: typing.Callable, shards: typing.List[tuple], restart_delay: float = 5, on_restart: typing.Optional[typing.Callable[[int], typing.Optional[tuple]]] = None):
+        super().__init__(name="supervisor", daemon=True)
+        self.__context = multiprocessing.get_context("spawn")
+        self.__target = target
+        self.__shards = list(shards)
+        self.__restart_delay = restart_delay
+        self.__processes = dict()
+        self.__crashes = dict()
+        self.__restarts = dict()
+        self.__stop = False
+        self.on_restart = on_restart
+
+    def __spawn(self, shard: int):
+        process = self.__context.Process(target=self.__target, args=(shard, *self.__shards[shard]), name="shard-{}".format(shard), daemon=True)
+        process.start()
+        self.__processes[shard] = (process, time.monotonic())
+        logger.info("started shard %s (pid %s)", shard, process.pid)
+
+    def run(self):
+        for shard in range(len(self.__shards)):
+            self.__spawn(shard)
+        while not self.__stop:
+            time.sleep(1)
+            for shard, (process, started) in list(self.__processes.items()):
+                if self.__stop:
+                    break
+                if process.is_alive():
+                    continue
+                if shard not in self.__restarts:
+                    crashes = self.__crashes.get(shard, 0) + 1 if time.monotonic() - started < 60 else 1
+                    self.__crashes[shard] = crashes
+                    delay = min(self.__restart_delay * 2 ** (crashes - 1), 300)
+                    logger.error("shard %s exited with %s - restarting in %ss", shard, process.exitcode, delay)
+                    self.__restarts[shard] = time.monotonic() + delay
+                elif time.monotonic() >= self.__restarts[shard]:
+                    del self.__restarts[shard]
+                    if self.on_restart:
+                        args = self.on_restart(shard)
+                        if args is not None:
+                            self.__shards[shard] = args
+                    self.__spawn(shard)
+
+    def stop(self):
+        self.__stop = True
+        for process, _ in list(self.__processes.values()):
+            process.terminate()
+        for process, _ in list(self.__processes.values()):
+            process.join()
+
+    @property
+    def stats(self) -> dict:
+        return {shard: {"pid": process.pid, "alive": process.is_alive(), "crashes": self.__crashes.get(shard, 0)} for shard, (process, _) in self.__processes.items()}